@@ -1,3 +1,9 @@
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -8,8 +14,10 @@ from rasterio.warp import transform_bounds
 
 import streamlit as st
 import folium
+from packaging.version import Version
 from folium.raster_layers import ImageOverlay
-from folium.plugins import DualMap
+from folium.plugins import DualMap, VectorGridProtobuf
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from streamlit_folium import st_folium
 
 
@@ -28,14 +36,61 @@ OUTPUTS = ROOT / "outputs"
 
 YEARS = [2017, 2019, 2021, 2024]
 
-NDVI = {y: DATA_PROCESSED / f"ndvi_pudahuel_{y}.tif" for y in YEARS}
-NDBI = {y: DATA_PROCESSED / f"ndbi_pudahuel_{y}.tif" for y in YEARS}
-DELTA_NDVI = DATA_PROCESSED / "delta_ndvi_2017_2024.tif"
-DELTA_NDBI = DATA_PROCESSED / "delta_ndbi_2017_2024.tif"
+INDEX_PRODUCTS = {
+    i: {y: DATA_PROCESSED / f"{i}_pudahuel_{y}.tif" for y in YEARS} for i in ("ndvi", "ndbi", "ndwi", "bsi")
+}
+NDVI = INDEX_PRODUCTS["ndvi"]
+NDBI = INDEX_PRODUCTS["ndbi"]
+URBAN_CHANGE = DATA_PROCESSED / "cambio_urbano_binario.tif"
+
+CUBE_DIR = DATA_PROCESSED / "cube"
+ZONE_STORE_DIR = DATA_PROCESSED / "zone_store"
 
 ZONES_GPKG = DATA_PROCESSED / "cambios_por_zona.gpkg"
 ZONES_CSV = OUTPUTS / "cambios_por_zona_pudahuel.csv"
 
+# Servidor de teselas local (modo teselas). En Docker, exponer el puerto y
+# fijar TILE_SERVER_URL a la dirección que ve el navegador.
+TILE_SERVER_HOST = os.getenv("TILE_SERVER_HOST", "127.0.0.1")
+TILE_SERVER_PORT = int(os.getenv("TILE_SERVER_PORT", "0"))
+TILE_SERVER_URL = os.getenv("TILE_SERVER_URL")
+
+MAP_ZOOM = 12
+# Los overlays se leen para un nivel más que el inicial (margen al acercar) y
+# con el lado mayor acotado al tamaño de pantalla.
+OVERLAY_ZOOM = MAP_ZOOM + 1
+OVERLAY_MAX_SIZE = int(os.getenv("OVERLAY_MAX_SIZE", "2048"))
+
+# Caché de render en disco, compartido entre procesos/réplicas del servicio web
+RENDER_CACHE_DIR = Path(os.getenv("RENDER_CACHE_DIR", str(ROOT / "data" / "cache" / "render")))
+RENDER_CACHE_MAX_MB = int(os.getenv("RENDER_CACHE_MAX_MB", "512"))
+# Incrementar al cambiar el colormap/stretch para invalidar overlays guardados
+RENDER_VERSION = 2
+
+# Exportaciones filtradas (se generan al pedirlas y quedan en disco)
+EXPORT_CACHE_DIR = Path(os.getenv("EXPORT_CACHE_DIR", str(ROOT / "data" / "cache" / "export")))
+# st.download_button acepta un callable en `data` (generación diferida al hacer clic) desde Streamlit 1.52
+DEFERRED_DOWNLOADS = Version(st.__version__) >= Version("1.52.0")
+
+# Caché LRU de los cambios calculados bajo demanda (GeoTIFF)
+CHANGE_CACHE_DIR = Path(os.getenv("CHANGE_CACHE_DIR", str(ROOT / "data" / "cache" / "change")))
+CHANGE_CACHE_MAX_MB = int(os.getenv("CHANGE_CACHE_MAX_MB", "1024"))
+
+sys.path.insert(0, str(ROOT / "scripts"))
+from change_detection import ChangeDetector  # noqa: E402
+from classify import classify  # noqa: E402
+from datacube import open_cube  # noqa: E402
+from disk_cache import DiskCache, cached_call, file_fingerprint, make_key  # noqa: E402
+from exports import FORMATS, ZoneExporter, available_formats, zone_filter  # noqa: E402
+from point_query import PointQuery  # noqa: E402
+from raster_io import ensure_overviews, read_decimated, shape_for_zoom  # noqa: E402
+from raster_render import colorize, ramp_for  # noqa: E402
+from raster_stats import year_stats  # noqa: E402
+from raster_stretch import common_stretch, layer_stretch  # noqa: E402
+from raster_tiles import TileServer  # noqa: E402
+from zone_store import ZoneIndex, open_zone_store  # noqa: E402
+from zones_web import MVT_LAYER, ClassifiedZones, ZoneTileSource, mvt_available, zones_geojson  # noqa: E402
+
 
 # -----------------------------
 # Helpers
@@ -46,9 +101,17 @@ def file_ok(p: Path) -> bool:
 
 @st.cache_data(show_spinner=False)
 def load_zones():
+    """Zonas en WGS84 con las columnas del mapa y del índice (`zone_id` y métricas), y su centro."""
     if not file_ok(ZONES_GPKG):
         return None
+    columns = ["zone_id", *ZONE_METRICS]
+    # Almacén GeoParquet (scripts/zone_store.py): ya en WGS84, solo las columnas usadas y centro precalculado
+    store = open_zone_store(ZONE_STORE_DIR)
+    if store is not None and store.center is not None:
+        return store.read(columns), store.center
+
     gdf = gpd.read_file(ZONES_GPKG)
+    gdf = gdf[[c for c in columns if c in gdf.columns] + ["geometry"]]
 
     # Asegurar WGS84 para mapa
     if gdf.crs is None:
@@ -56,19 +119,59 @@ def load_zones():
     else:
         gdf = gdf.to_crs("EPSG:4326")
 
-    centroid = gdf.unary_union.centroid
+    centroid = gdf.union_all().centroid
     return gdf, (centroid.y, centroid.x)
 
 
 @st.cache_data(show_spinner=False)
-def raster_to_png_and_bounds(raster_path: Path, vmin=None, vmax=None):
-    with rasterio.open(raster_path) as src:
-        arr = src.read(1).astype("float32")
-        nodata = src.nodata
+def load_zone_table():
+    """Todas las columnas de atributos de las zonas (sin geometría), para la tabla de datos."""
+    if not file_ok(ZONES_GPKG):
+        return None
+    store = open_zone_store(ZONE_STORE_DIR)
+    if store is not None:
+        return pd.DataFrame(store.read(store.columns).drop(columns="geometry"))
+    return pd.DataFrame(gpd.read_file(ZONES_GPKG, ignore_geometry=True))
 
-        # Mask nodata
-        if nodata is not None:
-            arr = np.where(arr == nodata, np.nan, arr)
+
+@st.cache_resource(show_spinner=False)
+def get_zone_index():
+    """Índice compartido por los paneles de zonas (id -> fila, ranking por métrica)."""
+    res = load_zones()
+    if res is None or "zone_id" not in res[0].columns:
+        return None
+    return ZoneIndex(res[0])
+
+
+@st.cache_resource(show_spinner=False)
+def get_render_cache():
+    try:
+        return DiskCache(RENDER_CACHE_DIR, max_bytes=RENDER_CACHE_MAX_MB * 2 ** 20)
+    except OSError:
+        return None
+
+
+@st.cache_data(show_spinner=False)
+def raster_to_png_and_bounds(raster_path: Path, vmin=None, vmax=None, zoom=None, max_size=None):
+    # Con zoom, se lee a la resolución que tendrá en pantalla (vía overviews).
+    # Se construyen antes de la huella, porque cambian el mtime del archivo.
+    if zoom is not None:
+        ensure_overviews(raster_path)
+
+    key = make_key("overlay", RENDER_VERSION, file_fingerprint(raster_path), vmin, vmax, zoom, max_size)
+    return cached_call(
+        get_render_cache(),
+        key,
+        lambda: _render_overlay(raster_path, vmin, vmax, zoom, max_size),
+        to_payload=lambda res: ({"rgba": res[0]}, {"bounds": res[1]}),
+        from_payload=lambda arrays, meta: (arrays["rgba"], meta["bounds"]),
+    )
+
+
+def _render_overlay(raster_path: Path, vmin, vmax, zoom, max_size):
+    with rasterio.open(raster_path) as src:
+        out_shape = shape_for_zoom(src, zoom, max_size=max_size) if zoom is not None else None
+        arr = read_decimated(src, out_shape)
 
         # Bounds a EPSG:4326
         if src.crs is None:
@@ -82,40 +185,21 @@ def raster_to_png_and_bounds(raster_path: Path, vmin=None, vmax=None):
         if not np.any(finite):
             raise ValueError(f"Raster vacío o sin datos válidos: {raster_path.name}")
 
-        if vmin is None:
-            vmin = np.nanpercentile(arr, 2)
-        if vmax is None:
-            vmax = np.nanpercentile(arr, 98)
-
-        arr = np.clip(arr, vmin, vmax)
-        norm = (arr - vmin) / (vmax - vmin + 1e-9)
-        norm = np.where(np.isfinite(norm), norm, np.nan)
-
-        # Colormap simple (rojo -> amarillo -> verde)
-        def colormap(x):
-            r = np.clip(2 - 2 * x, 0, 1)
-            g = np.clip(2 * x, 0, 1)
-            b = np.clip(0.30 + 0 * x, 0, 1)
-            return r, g, b
-
-        r, g, b = colormap(norm)
-        a = np.where(np.isfinite(norm), 0.85, 0.0)
-
-        rgba = np.dstack(
-            [
-                (r * 255).astype(np.uint8),
-                (g * 255).astype(np.uint8),
-                (b * 255).astype(np.uint8),
-                (a * 255).astype(np.uint8),
-            ]
-        )
+        if vmin is None or vmax is None:
+            # Percentiles 2–98 desde el histograma del raster (sidecar), no del arreglo
+            lo, hi = layer_stretch(raster_path)
+            vmin = lo if vmin is None else vmin
+            vmax = hi if vmax is None else vmax
+
+        # Paleta secuencial para NDVI/NDBI y divergente para los deltas
+        rgba = colorize(arr, vmin, vmax, ramp=ramp_for(raster_path))
 
     bounds = [[south, west], [north, east]]
     return rgba, bounds
 
 
 def make_map_base(center):
-    return folium.Map(location=center, zoom_start=12, control_scale=True, tiles="OpenStreetMap")
+    return folium.Map(location=center, zoom_start=MAP_ZOOM, control_scale=True, tiles="OpenStreetMap")
 
 
 def add_overlay(m, rgba, bounds, name):
@@ -130,64 +214,253 @@ def add_overlay(m, rgba, bounds, name):
     ).add_to(m)
 
 
-def add_zones_layer(m, zones_gdf):
-    gdf = zones_gdf.copy()
-    if "perc_gain_built" not in gdf.columns:
-        return
+@st.cache_resource(show_spinner=False)
+def get_tile_server():
+    return TileServer(host=TILE_SERVER_HOST, port=TILE_SERVER_PORT, public_url=TILE_SERVER_URL)
 
-    vals = gdf["perc_gain_built"].fillna(0).values
-    q = np.quantile(vals, [0.5, 0.75, 0.9, 0.97])
-
-    def style_fn(feat):
-        v = feat["properties"].get("perc_gain_built", 0) or 0
-        if v <= q[0]:
-            color = "#fff5f0"
-        elif v <= q[1]:
-            color = "#fcbba1"
-        elif v <= q[2]:
-            color = "#fc9272"
-        elif v <= q[3]:
-            color = "#fb6a4a"
-        else:
-            color = "#cb181d"
-        return {"fillColor": color, "color": "#999999", "weight": 0.3, "fillOpacity": 0.6}
-
-    folium.GeoJson(
-        gdf,
-        name="Zonas (intensidad cambio construido)",
-        style_function=style_fn,
-        tooltip=folium.GeoJsonTooltip(
-            fields=["zone_id", "perc_loss_veg", "perc_gain_built"],
-            aliases=["Zona", "% Pérdida veg", "% Aumento construido"],
-        ),
+
+def add_tile_layer(m, raster_path, name, vmin=None, vmax=None):
+    url = get_tile_server().url_template(raster_path, vmin=vmin, vmax=vmax)
+    folium.TileLayer(
+        tiles=url,
+        attr="GEOLAB",
+        name=name,
+        overlay=True,
+        control=True,
+        opacity=0.9,
+        max_zoom=19,
     ).add_to(m)
 
 
+def render_overlay(raster_path, native=False, vmin=None, vmax=None):
+    if native:
+        return raster_to_png_and_bounds(raster_path, vmin, vmax)
+    return raster_to_png_and_bounds(raster_path, vmin, vmax, zoom=OVERLAY_ZOOM, max_size=OVERLAY_MAX_SIZE)
+
+
+def render_overlays_concurrently(raster_paths, native=False, vmin=None, vmax=None):
+    # Hilos con el contexto de Streamlit para que st.cache_data funcione en ellos;
+    # la lectura y decodificación en rasterio liberan el GIL.
+    ctx = get_script_run_ctx()
+
+    def job(p):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return render_overlay(p, native, vmin, vmax)
+
+    with ThreadPoolExecutor(max_workers=len(raster_paths)) as pool:
+        return list(pool.map(job, raster_paths))
+
+
+@st.cache_resource(show_spinner=False)
+def get_point_query():
+    # Datasets abiertos compartidos entre sesiones; cada consulta lee 1 píxel por año e índice
+    return PointQuery(INDEX_PRODUCTS)
+
+
+def point_series(lat, lon):
+    """DataFrame Año x índice con los valores del píxel clicado (vacío si cae fuera)."""
+    values = get_point_query().query(lon, lat)
+    df = pd.DataFrame({i.upper(): v for i, v in values.items()})
+    df.index.name = "Año"
+    return df.dropna(how="all")
+
+
+@st.cache_resource(show_spinner=False)
+def get_change_detector():
+    return ChangeDetector(
+        {"ndvi": NDVI, "ndbi": NDBI}, CHANGE_CACHE_DIR, max_bytes=CHANGE_CACHE_MAX_MB * 2 ** 20
+    )
+
+
+def change_layer(kind, year_a, year_b):
+    """(ruta, nombre) del Δ`kind` ("ndvi"/"ndbi") o de la máscara de cambio ("cambio") entre dos años."""
+    name = "Cambio urbano" if kind == "cambio" else f"Δ{kind.upper()}"
+    name = f"{name} {year_b}-{year_a}"
+    # Productos ya generados (notebooks o scripts/pipeline.py); si no, se calculan bajo demanda
+    if kind == "cambio":
+        candidates = [DATA_PROCESSED / f"cambio_urbano_{year_a}_{year_b}.tif"]
+        if (year_a, year_b) == (2017, 2024):
+            candidates.append(URBAN_CHANGE)
+    else:
+        candidates = [DATA_PROCESSED / f"delta_{kind}_{year_a}_{year_b}.tif"]
+    for pre in candidates:
+        if file_ok(pre):
+            return pre, name
+    detector = get_change_detector()
+    with st.spinner(f"Calculando {name}..."):
+        if kind == "cambio":
+            return detector.urban_change(year_a, year_b), name
+        return detector.delta(kind, year_a, year_b), name
+
+
+def add_raster_layer(m, raster_path, name, tiled=False, native=False):
+    if tiled:
+        add_tile_layer(m, raster_path, name)
+    else:
+        rgba, bounds = render_overlay(raster_path, native)
+        add_overlay(m, rgba, bounds, name)
+
+
+ZONE_METRICS = {
+    "perc_gain_built": "Zonas (intensidad cambio construido)",
+    "perc_loss_veg": "Zonas (pérdida de vegetación)",
+}
+ZONE_SCHEMES = {
+    "Percentiles (P50/P75/P90/P97)": "percentiles",
+    "Cuantiles": "quantile",
+    "Intervalos iguales": "equal_interval",
+    "Cortes naturales (Jenks)": "natural_breaks",
+}
+
+
 @st.cache_data(show_spinner=False)
-def compute_year_stats(index_dict):
-    rows = []
-    for y, p in index_dict.items():
-        if not file_ok(p):
-            continue
-        with rasterio.open(p) as src:
-            a = src.read(1).astype("float32")
-            nodata = src.nodata
-            if nodata is not None:
-                a = np.where(a == nodata, np.nan, a)
-
-            rows.append(
-                {
-                    "Año": y,
-                    "Media": float(np.nanmean(a)),
-                    "Std": float(np.nanstd(a)),
-                    "Min": float(np.nanmin(a)),
-                    "Max": float(np.nanmax(a)),
-                }
-            )
-    df = pd.DataFrame(rows)
+def zone_classes(metric, scheme, k):
+    # Clases de todas las zonas en una pasada; se cachea por (métrica, esquema, k)
+    zones_gdf, _ = load_zones()
+    classes, breaks, colors = classify(zones_gdf[metric].values, scheme, k)
+    return classes, breaks.tolist(), colors
+
+
+@st.cache_data(show_spinner=False)
+def zones_web_geojson(zoom, metric, scheme, k):
+    # Zonas simplificadas/cuantizadas para el zoom, con la clase como propiedad
+    zones_gdf, _ = load_zones()
+    classes, _, _ = zone_classes(metric, scheme, k)
+    return zones_geojson(zones_gdf, zoom, classes=classes)
+
+
+@st.cache_resource(show_spinner=False)
+def get_zone_tiles_url():
+    zones_gdf, _ = load_zones()
+    return get_tile_server().add_vector_source("zones", ZoneTileSource(zones_gdf))
+
+
+def add_zones_vector_layer(m, metric, breaks, colors):
+    # En MVT la clase se asigna en el navegador con los mismos cortes
+    options = """{
+        "vectorTileLayerStyles": {
+            "%s": function(p) {
+                var b = %s, c = %s, v = p.%s || 0, i = 0;
+                while (i < b.length && v > b[i]) i++;
+                return {"fill": true, "fillColor": c[i], "color": "#999999", "weight": 0.3, "fillOpacity": 0.6};
+            }
+        }
+    }""" % (MVT_LAYER, json.dumps(breaks), json.dumps(colors), metric)
+    VectorGridProtobuf(get_zone_tiles_url(), ZONE_METRICS[metric], options).add_to(m)
+
+
+ZONE_TOOLTIP = [
+    ("zone_id", "Zona"),
+    ("perc_loss_veg", "% Pérdida veg"),
+    ("perc_gain_built", "% Aumento construido"),
+]
+
+
+def add_zones_layer(
+    m, zones_gdf, vector_tiles=False, metric="perc_gain_built", scheme="percentiles", k=5, shared_with=None
+):
+    """Agrega la capa de zonas y la devuelve; `shared_with` reutiliza los datos ya incrustados por otra capa."""
+    if metric not in zones_gdf.columns:
+        return None
+
+    _, breaks, colors = zone_classes(metric, scheme, k)
+
+    if vector_tiles:
+        add_zones_vector_layer(m, metric, breaks, colors)
+        return None
+
+    styles = [{"fillColor": c, "color": "#999999", "weight": 0.3, "fillOpacity": 0.6} for c in colors]
+
+    layer = ClassifiedZones(
+        None if shared_with is not None else zones_web_geojson(MAP_ZOOM, metric, scheme, k),
+        styles=styles,
+        tooltip=ZONE_TOOLTIP,
+        name=ZONE_METRICS[metric],
+        shared_with=shared_with,
+    )
+    layer.add_to(m)
+    return layer
+
+
+@st.cache_resource(show_spinner=False)
+def get_cube():
+    return open_cube(CUBE_DIR)
+
+
+def fresh_cube(index=None):
+    """El cubo espacio-temporal si existe, está al día y contiene `index`."""
+    cube = get_cube()
+    if cube is None or not cube.is_fresh() or (index is not None and not cube.has(index)):
+        return None
+    return cube
+
+
+@st.cache_data(show_spinner=False)
+def compute_year_stats(index_dict, index=None):
+    sources = [(y, file_fingerprint(p)) for y, p in sorted(index_dict.items()) if file_ok(p)]
+    df = cached_call(
+        get_render_cache(),
+        make_key("year_stats", sources),
+        lambda: _compute_year_stats(index_dict, index),
+        to_payload=lambda df: ({}, {"rows": df.to_dict("records")}),
+        from_payload=lambda arrays, meta: pd.DataFrame(meta["rows"]),
+    )
     return df.sort_values("Año") if not df.empty else df
 
 
+def _compute_year_stats(index_dict, index=None):
+    available = {y: p for y, p in index_dict.items() if file_ok(p)}
+    cube = fresh_cube(index)
+    if cube is not None and all(cube.has(index, y) for y in available):
+        return pd.DataFrame(cube.year_stats(index))
+    # Una pasada por ventanas por año, con los años en paralelo
+    return pd.DataFrame(year_stats(available))
+
+
+@st.cache_data(show_spinner=False)
+def zone_index_series(zone_id, index):
+    """Media anual de `index` dentro de la zona, leída del cubo (None si no hay cubo)."""
+    cube = fresh_cube(index)
+    zidx = get_zone_index()
+    if cube is None or zidx is None:
+        return None
+    geom = gpd.GeoSeries([zidx.geometry(zone_id)], crs=zidx.gdf.crs).to_crs(cube.crs).iloc[0]
+    series = cube.zone_series(geom, index)
+    return pd.DataFrame({"Año": list(series), index.upper(): list(series.values())}).set_index("Año")
+
+
+@st.cache_resource(show_spinner=False)
+def get_zone_exporter():
+    return ZoneExporter(ZONES_GPKG, EXPORT_CACHE_DIR) if file_ok(ZONES_GPKG) else None
+
+
+def lazy_download_button(label, make_path, file_name, mime, key):
+    """
+    Botón de descarga cuyo contenido se genera solo al pedirlo.
+
+    Con Streamlit reciente el archivo se lee al hacer clic (en otro hilo); si
+    no, primero hay que pulsar "Preparar". En ningún caso los bytes quedan
+    en la sesión en cada rerun.
+    """
+    if DEFERRED_DOWNLOADS:
+        st.download_button(
+            label,
+            data=lambda: Path(make_path()).read_bytes(),
+            file_name=file_name,
+            mime=mime,
+            key=key,
+            on_click="ignore",
+            use_container_width=True,
+        )
+        return
+    if st.button(f"Preparar: {label}", key=f"{key}_prepare", use_container_width=True):
+        st.session_state[key] = str(make_path())
+    path = st.session_state.get(key)
+    if path and file_ok(Path(path)):
+        with open(path, "rb") as f:
+            st.download_button(label, data=f, file_name=file_name, mime=mime, key=key, use_container_width=True)
+
+
 def kpi_summary_from_zones(zones_gdf: gpd.GeoDataFrame):
     if zones_gdf is None:
         return None
@@ -219,11 +492,34 @@ with st.sidebar:
     st.markdown("**Capa principal**")
     layer_type = st.selectbox(
         "Selecciona capa",
-        ["NDVI", "NDBI", "ΔNDVI (2024-2017)", "ΔNDBI (2024-2017)"],
+        ["NDVI", "NDBI", "ΔNDVI", "ΔNDBI", "Cambio urbano (binario)"],
         index=0,
     )
-    year_view = st.selectbox("Año para NDVI/NDBI", YEARS, index=len(YEARS) - 1)
+    if layer_type in ("NDVI", "NDBI"):
+        year_view = st.selectbox("Año para NDVI/NDBI", YEARS, index=len(YEARS) - 1)
+    else:
+        change_from = st.selectbox("Año inicial", YEARS, index=0)
+        change_to = st.selectbox("Año final", YEARS, index=len(YEARS) - 1)
     show_zones = st.checkbox("Mostrar zonas (coroplético)", value=True)
+    zones_mvt = st.checkbox(
+        "Zonas como teselas vectoriales (MVT)",
+        value=False,
+        disabled=not mvt_available(),
+        help="Para grillas finas o áreas grandes. Requiere mapbox-vector-tile.",
+    )
+    zone_metric = st.selectbox("Métrica zonal", list(ZONE_METRICS), index=0)
+    zone_scheme = ZONE_SCHEMES[st.selectbox("Clasificación", list(ZONE_SCHEMES), index=0)]
+    zone_k = 5 if zone_scheme == "percentiles" else st.slider("Clases", 3, 7, 5)
+    tile_mode = st.checkbox(
+        "Modo teselas (rasters grandes)",
+        value=False,
+        help="Sirve el raster como teselas XYZ bajo demanda en lugar de una sola imagen.",
+    )
+    native_res = st.checkbox(
+        "Overlay a resolución nativa",
+        value=False,
+        help="Por defecto el overlay se lee a la resolución de pantalla usando overviews.",
+    )
 
     st.markdown("---")
     st.markdown("**Comparador**")
@@ -255,47 +551,50 @@ if page == "Explorar":
 
         try:
             if layer_type == "NDVI":
-                p = NDVI.get(year_view)
-                if not file_ok(p):
-                    st.error(f"No se encontró NDVI {year_view}: {p}")
-                else:
-                    rgba, bounds = raster_to_png_and_bounds(p)
-                    add_overlay(m, rgba, bounds, f"NDVI {year_view}")
-
+                p, name = NDVI.get(year_view), f"NDVI {year_view}"
             elif layer_type == "NDBI":
-                p = NDBI.get(year_view)
-                if not file_ok(p):
-                    st.error(f"No se encontró NDBI {year_view}: {p}")
-                else:
-                    rgba, bounds = raster_to_png_and_bounds(p)
-                    add_overlay(m, rgba, bounds, f"NDBI {year_view}")
-
-            elif layer_type == "ΔNDVI (2024-2017)":
-                if not file_ok(DELTA_NDVI):
-                    st.error(f"No se encontró: {DELTA_NDVI}")
-                else:
-                    rgba, bounds = raster_to_png_and_bounds(DELTA_NDVI)
-                    add_overlay(m, rgba, bounds, "ΔNDVI 2024-2017")
+                p, name = NDBI.get(year_view), f"NDBI {year_view}"
+            elif change_from < change_to:
+                kind = {"ΔNDVI": "ndvi", "ΔNDBI": "ndbi"}.get(layer_type, "cambio")
+                p, name = change_layer(kind, change_from, change_to)
+            else:
+                p, name = None, None
 
+            if p is None:
+                st.warning("El año final debe ser posterior al año inicial.")
+            elif not file_ok(p):
+                st.error(f"No se encontró {name}: {p}")
             else:
-                if not file_ok(DELTA_NDBI):
-                    st.error(f"No se encontró: {DELTA_NDBI}")
-                else:
-                    rgba, bounds = raster_to_png_and_bounds(DELTA_NDBI)
-                    add_overlay(m, rgba, bounds, "ΔNDBI 2024-2017")
+                add_raster_layer(m, p, name, tiled=tile_mode, native=native_res)
 
         except Exception as e:
             st.error(f"Error generando overlay: {e}")
 
         if show_zones and zones_gdf is not None:
-            add_zones_layer(m, zones_gdf)
+            add_zones_layer(m, zones_gdf, zones_mvt, zone_metric, zone_scheme, zone_k)
 
         folium.LayerControl(collapsed=True).add_to(m)
-        st_folium(m, width=None, height=620, use_container_width=True)
+        # Solo el clic provoca un rerun (no el pan/zoom)
+        map_state = st_folium(m, width=None, height=620, use_container_width=True, returned_objects=["last_clicked"])
 
     with right:
         st.subheader("Insights")
 
+        clicked = (map_state or {}).get("last_clicked")
+        if clicked:
+            t0 = time.perf_counter()
+            df_point = point_series(clicked["lat"], clicked["lng"])
+            elapsed = (time.perf_counter() - t0) * 1000
+            st.markdown(f"**Punto ({clicked['lat']:.5f}, {clicked['lng']:.5f})**")
+            if df_point.empty:
+                st.info("El punto está fuera de los rasters.")
+            else:
+                st.line_chart(df_point, use_container_width=True)
+                st.caption(f"Consulta: {elapsed:.0f} ms")
+        else:
+            st.caption("Haz clic en el mapa para ver la serie temporal de índices en ese punto.")
+        st.markdown("---")
+
         # KPIs de zona (si existen)
         kpis = kpi_summary_from_zones(zones_gdf)
         if zones_gdf is None:
@@ -314,8 +613,8 @@ if page == "Explorar":
         st.markdown("---")
 
         # Evolución sin tablas por defecto
-        df_ndvi = compute_year_stats(NDVI)
-        df_ndbi = compute_year_stats(NDBI)
+        df_ndvi = compute_year_stats(NDVI, "ndvi")
+        df_ndbi = compute_year_stats(NDBI, "ndbi")
 
         st.markdown("**Evolución temporal (media)**")
         sel = st.radio("Serie", ["NDVI", "NDBI"], horizontal=True, index=0)
@@ -334,12 +633,31 @@ if page == "Explorar":
         st.markdown("---")
 
         # Zona específica en modo “panel” (no en tablas)
-        if zones_gdf is not None and "zone_id" in zones_gdf.columns:
+        zidx = get_zone_index()
+        if zidx is not None:
             st.markdown("**Zona específica**")
-            zone_ids = zones_gdf["zone_id"].astype(int).sort_values().tolist()
-            z = st.selectbox("zone_id", zone_ids, index=0)
+            rank_labels = {
+                "zone_id": "zone_id",
+                "perc_gain_built": "Mayor % aumento construido",
+                "perc_loss_veg": "Mayor % pérdida vegetación",
+            }
+            rank_options = [m for m in rank_labels if m == "zone_id" or m in zidx.values]
+            order_by = st.selectbox("Listar por", rank_options, format_func=rank_labels.get)
+            if order_by == "zone_id":
+                zone_ids = zidx.sorted_ids
+                z = st.selectbox("zone_id", zone_ids, index=0)
+            else:
+                n = len(zidx)
+                k = st.slider("Top-k", min_value=1, max_value=max(2, min(100, n)), value=min(10, n))
+                zone_ids = zidx.top_k(order_by, k)
+                z = st.selectbox(
+                    "zone_id",
+                    zone_ids,
+                    index=0,
+                    format_func=lambda i: f"{i} ({zidx.value(order_by, i):.2f}%)",
+                )
 
-            row = zones_gdf[zones_gdf["zone_id"].astype(int) == int(z)].iloc[0]
+            row = zidx.row(z)
             a, b = st.columns(2)
             with a:
                 if "perc_loss_veg" in row:
@@ -359,6 +677,12 @@ if page == "Explorar":
                     ).set_index("Métrica"),
                     use_container_width=True,
                 )
+
+            # Evolución de los índices dentro de la zona (requiere el cubo espacio-temporal)
+            series = [zone_index_series(z, i) for i in ("ndvi", "ndbi")]
+            series = [s for s in series if s is not None]
+            if series:
+                st.line_chart(pd.concat(series, axis=1), use_container_width=True)
         else:
             st.info("Zonas no disponibles para selección (revisa el GPKG).")
 
@@ -367,7 +691,7 @@ elif page == "Comparar":
     st.subheader("Comparador visual antes/después (DualMap)")
     st.caption("Comparación lado a lado para el índice seleccionado. Útil para evidenciar cambios en el tiempo.")
 
-    dm = DualMap(location=center, zoom_start=12, tiles="OpenStreetMap")
+    dm = DualMap(location=center, zoom_start=MAP_ZOOM, tiles="OpenStreetMap")
 
     try:
         if comp_index == "NDVI":
@@ -380,15 +704,26 @@ elif page == "Comparar":
             nameL, nameR = f"NDBI {year_left}", f"NDBI {year_right}"
 
         if file_ok(pL) and file_ok(pR):
-            rgbaL, boundsL = raster_to_png_and_bounds(pL)
-            rgbaR, boundsR = raster_to_png_and_bounds(pR)
-
-            add_overlay(dm.m1, rgbaL, boundsL, nameL)
-            add_overlay(dm.m2, rgbaR, boundsR, nameR)
+            # Stretch común (histogramas de ambos años sumados) para que los colores sean comparables.
+            # Las overviews van primero porque cambian el mtime que valida los sidecars.
+            for p in (pL, pR):
+                ensure_overviews(p)
+            vmin, vmax = common_stretch([pL, pR])
+
+            if tile_mode:
+                add_tile_layer(dm.m1, pL, nameL, vmin, vmax)
+                add_tile_layer(dm.m2, pR, nameR, vmin, vmax)
+            else:
+                (rgbaL, boundsL), (rgbaR, boundsR) = render_overlays_concurrently(
+                    [pL, pR], native=native_res, vmin=vmin, vmax=vmax
+                )
+                add_overlay(dm.m1, rgbaL, boundsL, nameL)
+                add_overlay(dm.m2, rgbaR, boundsR, nameR)
 
             if show_zones and zones_gdf is not None:
-                add_zones_layer(dm.m1, zones_gdf)
-                add_zones_layer(dm.m2, zones_gdf)
+                # El GeoJSON se incrusta una sola vez; el panel derecho reutiliza la variable JS
+                zones_left = add_zones_layer(dm.m1, zones_gdf, zones_mvt, zone_metric, zone_scheme, zone_k)
+                add_zones_layer(dm.m2, zones_gdf, zones_mvt, zone_metric, zone_scheme, zone_k, shared_with=zones_left)
 
             folium.LayerControl(collapsed=True).add_to(dm.m1)
             folium.LayerControl(collapsed=True).add_to(dm.m2)
@@ -410,23 +745,23 @@ else:  # page == "Datos"
     with c1:
         st.markdown("**Archivos de salida**")
         if file_ok(ZONES_CSV):
-            st.download_button(
+            lazy_download_button(
                 "Descargar CSV (cambios por zona)",
-                data=ZONES_CSV.read_bytes(),
+                lambda: ZONES_CSV,
                 file_name="cambios_por_zona_pudahuel.csv",
                 mime="text/csv",
-                use_container_width=True,
+                key="dl_zones_csv",
             )
         else:
             st.info("No se encontró el CSV en outputs/. Genera el CSV en el Notebook 03.")
 
         if file_ok(ZONES_GPKG):
-            st.download_button(
+            lazy_download_button(
                 "Descargar GPKG (zonas + métricas)",
-                data=ZONES_GPKG.read_bytes(),
+                lambda: ZONES_GPKG,
                 file_name="cambios_por_zona.gpkg",
                 mime="application/geopackage+sqlite3",
-                use_container_width=True,
+                key="dl_zones_gpkg",
             )
         else:
             st.info("No se encontró el GPKG en data/processed/. Genera el GPKG en el Notebook 03.")
@@ -438,11 +773,53 @@ else:  # page == "Datos"
         else:
             with st.expander("Ver tabla de zonas (GPKG)", expanded=False):
                 st.dataframe(
-                    zones_gdf.drop(columns=["geometry"], errors="ignore"),
+                    load_zone_table(),
                     use_container_width=True,
                     hide_index=True,
                 )
 
+    exporter = get_zone_exporter()
+    if exporter is not None and zones_gdf is not None:
+        st.markdown("---")
+        st.markdown("**Exportación filtrada**")
+        e1, e2 = st.columns([1, 1])
+        with e1:
+            fmt = st.selectbox("Formato", available_formats(), index=0)
+            zone_range = None
+            zidx = get_zone_index()
+            if zidx is not None and len(zidx):
+                lo, hi = zidx.sorted_ids[0], zidx.sorted_ids[-1]
+                zone_range = st.slider("Rango de zone_id", lo, max(hi, lo + 1), (lo, max(hi, lo + 1)))
+                if zone_range == (lo, max(hi, lo + 1)):
+                    zone_range = None
+            metric_options = ["(sin umbral)"] + [m for m in ZONE_METRICS if m in zones_gdf.columns]
+            metric = st.selectbox("Métrica", metric_options, index=0)
+            threshold = None
+            if metric != metric_options[0]:
+                threshold = st.number_input(f"{metric} ≥", value=float(zones_gdf[metric].median()))
+        with e2:
+            bbox = None
+            if st.checkbox("Filtrar por bbox (WGS84)", value=False):
+                minx, miny, maxx, maxy = (float(v) for v in zones_gdf.total_bounds)
+                b1, b2 = st.columns(2)
+                with b1:
+                    minx = st.number_input("Lon mín", value=minx, format="%.5f")
+                    miny = st.number_input("Lat mín", value=miny, format="%.5f")
+                with b2:
+                    maxx = st.number_input("Lon máx", value=maxx, format="%.5f")
+                    maxy = st.number_input("Lat máx", value=maxy, format="%.5f")
+                bbox = (minx, miny, maxx, maxy)
+
+        filt = zone_filter(zone_range, bbox, None if metric == metric_options[0] else metric, threshold)
+        suffix, mime = FORMATS[fmt][:2]
+        lazy_download_button(
+            f"Descargar zonas filtradas ({fmt})",
+            lambda: exporter.export(fmt, filt),
+            file_name=f"zonas_filtradas{suffix}",
+            mime=mime,
+            key=f"dl_export_{make_key(fmt, filt)}",
+        )
+
 
 st.markdown("---")
 st.caption("Curso: Desarrollo de Aplicaciones Geoinformáticas | Estudiantes: Diego Valdés y Valentina Campos | Prof.: Francisco Parra")
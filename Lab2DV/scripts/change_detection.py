@@ -0,0 +1,122 @@
+"""
+Detección de cambios bajo demanda para cualquier par de años.
+
+Calcula ΔÍndice (año final - año inicial) y la máscara binaria de cambio
+urbano (pérdida de vegetación y aumento de construido a la vez) por
+ventanas. Los resultados se guardan como GeoTIFF en un caché LRU en disco
+(`DiskCache`) cuya clave incluye la huella de los rasters de origen: el
+primer pedido de un par se calcula y los siguientes son inmediatos.
+"""
+import logging
+
+import numpy as np
+import rasterio
+
+from disk_cache import DiskCache, file_fingerprint, make_key
+from indices import OUTPUT_PROFILE, WINDOW_SIZE
+from raster_io import ensure_overviews, iter_tiles
+
+logger = logging.getLogger(__name__)
+
+# Umbrales de la máscara de cambio urbano
+NDVI_LOSS = -0.1
+NDBI_GAIN = 0.1
+MASK_NODATA = 255
+# Incrementar al cambiar fórmulas o umbrales para invalidar el caché
+CHANGE_VERSION = 1
+
+
+def _check_grid(srcs):
+    ref = srcs[0]
+    for src in srcs[1:]:
+        if (src.width, src.height, src.transform, src.crs) != (ref.width, ref.height, ref.transform, ref.crs):
+            raise ValueError(f"{src.name} no comparte la grilla de {ref.name}")
+    return ref
+
+
+def _read(src, window):
+    return src.read(1, window=window, masked=True).astype("float32").filled(np.nan)
+
+
+def write_delta(path_a, path_b, out_path):
+    """Escribe `path_b - path_a` por ventanas en un GeoTIFF teselado."""
+    with rasterio.open(path_a) as a, rasterio.open(path_b) as b:
+        ref = _check_grid([a, b])
+        profile = dict(
+            OUTPUT_PROFILE, driver="GTiff", width=ref.width, height=ref.height, crs=ref.crs, transform=ref.transform
+        )
+        with rasterio.open(out_path, "w", **profile) as dst:
+            for window in iter_tiles(ref.width, ref.height, WINDOW_SIZE):
+                dst.write(_read(b, window) - _read(a, window), 1, window=window)
+    ensure_overviews(out_path, lock=False)
+
+
+def write_change_mask(ndvi_a, ndvi_b, ndbi_a, ndbi_b, out_path, ndvi_loss=NDVI_LOSS, ndbi_gain=NDBI_GAIN):
+    """Máscara uint8: 1 donde ΔNDVI <= `ndvi_loss` y ΔNDBI >= `ndbi_gain`, 0 en otro caso."""
+    paths = [ndvi_a, ndvi_b, ndbi_a, ndbi_b]
+    srcs = [rasterio.open(p) for p in paths]
+    try:
+        ref = _check_grid(srcs)
+        profile = dict(
+            OUTPUT_PROFILE,
+            driver="GTiff",
+            dtype="uint8",
+            nodata=MASK_NODATA,
+            predictor=1,
+            width=ref.width,
+            height=ref.height,
+            crs=ref.crs,
+            transform=ref.transform,
+        )
+        with rasterio.open(out_path, "w", **profile) as dst:
+            for window in iter_tiles(ref.width, ref.height, WINDOW_SIZE):
+                va, vb, ba, bb = (_read(src, window) for src in srcs)
+                d_ndvi, d_ndbi = vb - va, bb - ba
+                mask = ((d_ndvi <= ndvi_loss) & (d_ndbi >= ndbi_gain)).astype("uint8")
+                mask[np.isnan(d_ndvi) | np.isnan(d_ndbi)] = MASK_NODATA
+                dst.write(mask, 1, window=window)
+    finally:
+        for src in srcs:
+            src.close()
+    ensure_overviews(out_path, lock=False)
+
+
+class ChangeDetector:
+    """
+    Servicio de ΔÍndice y máscara de cambio con resultados en caché.
+
+    `products` es {índice: {año: ruta}} con los productos por año.
+    """
+
+    def __init__(self, products, cache_dir, max_bytes=1024 * 2 ** 20):
+        self.products = products
+        self.cache = DiskCache(cache_dir, max_bytes=max_bytes, suffix=".tif")
+
+    def _sources(self, index, year_a, year_b):
+        try:
+            return self.products[index][year_a], self.products[index][year_b]
+        except KeyError:
+            raise ValueError(f"No hay {index.upper()} para {year_a} y {year_b}") from None
+
+    def _get_or_compute(self, prefix, sources, write):
+        # El prefijo queda en el nombre del archivo: define paleta y dominio al renderizar
+        key = f"{prefix}_" + make_key(CHANGE_VERSION, [file_fingerprint(p) for p in sources])[:16]
+        path = self.cache.get_path(key)
+        if path is not None:
+            return path
+        logger.info(f"Calculando {prefix}")
+        return self.cache.put_file(key, write)
+
+    def delta(self, index, year_a, year_b):
+        """Ruta del GeoTIFF Δ`index` (`year_b` - `year_a`)."""
+        a, b = self._sources(index, year_a, year_b)
+        return self._get_or_compute(
+            f"delta_{index}_{year_a}_{year_b}", [a, b], lambda out: write_delta(a, b, out)
+        )
+
+    def urban_change(self, year_a, year_b):
+        """Ruta de la máscara binaria de cambio urbano entre `year_a` y `year_b`."""
+        sources = [*self._sources("ndvi", year_a, year_b), *self._sources("ndbi", year_a, year_b)]
+        return self._get_or_compute(
+            f"cambio_urbano_{year_a}_{year_b}", sources, lambda out: write_change_mask(*sources, out)
+        )
@@ -0,0 +1,109 @@
+"""
+Clasificación vectorizada para mapas coropléticos.
+
+Los cortes se calculan una vez por (métrica, esquema, k) y la clase de
+todas las zonas se asigna en una sola llamada a `np.digitize`; el mapa solo
+lee la clase ya calculada de cada entidad.
+"""
+import numpy as np
+
+# Cortes originales del dashboard: P50/P75/P90/P97 (5 clases)
+DEFAULT_PERCENTILES = (0.5, 0.75, 0.9, 0.97)
+SCHEMES = ("percentiles", "quantile", "equal_interval", "natural_breaks")
+
+# Paleta Reds (ColorBrewer) de 5 clases usada originalmente; para otros k se interpola
+REDS = ["#fff5f0", "#fcbba1", "#fc9272", "#fb6a4a", "#cb181d"]
+
+NATURAL_BREAKS_SAMPLE = 2000
+
+
+def quantile_breaks(values, k):
+    return np.quantile(values, np.linspace(0, 1, k + 1)[1:-1])
+
+
+def equal_interval_breaks(values, k):
+    lo, hi = float(np.min(values)), float(np.max(values))
+    return np.linspace(lo, hi, k + 1)[1:-1]
+
+
+def natural_breaks(values, k, sample_size=NATURAL_BREAKS_SAMPLE, seed=0):
+    """
+    Cortes naturales de Jenks (Fisher) por programación dinámica.
+
+    Se trabaja sobre los valores ordenados, submuestreados a `sample_size`
+    cuantiles si hay más; el costo de cada tramo sale de sumas acumuladas,
+    así que cada paso es una operación vectorizada y no un doble ciclo.
+    """
+    v = np.sort(np.asarray(values, dtype=np.float64))
+    if v.size > sample_size:
+        v = np.quantile(v, np.linspace(0, 1, sample_size))
+    n = v.size
+    if n <= k:
+        return v[:-1] if n > 1 else v
+
+    s1 = np.concatenate([[0.0], np.cumsum(v)])
+    s2 = np.concatenate([[0.0], np.cumsum(v * v)])
+
+    def sse(start, end):
+        # Suma de cuadrados de v[start:end] respecto a su media (vectorizado en start)
+        cnt = end - start
+        s = s1[end] - s1[start]
+        return (s2[end] - s2[start]) - s * s / cnt
+
+    # cost[j, i]: mejor costo de dividir v[:i] en j+1 clases; back: inicio de la última
+    cost = np.full((k, n + 1), np.inf)
+    back = np.zeros((k, n + 1), dtype=np.int64)
+    ends = np.arange(1, n + 1)
+    cost[0, 1:] = sse(np.zeros(n, dtype=np.int64), ends)
+    for j in range(1, k):
+        for i in range(j + 1, n + 1):
+            starts = np.arange(j, i)
+            c = cost[j - 1, starts] + sse(starts, i)
+            m = int(np.argmin(c))
+            cost[j, i] = c[m]
+            back[j, i] = starts[m]
+
+    breaks = []
+    i = n
+    for j in range(k - 1, 0, -1):
+        i = back[j, i]
+        breaks.append(v[i - 1])
+    return np.array(breaks[::-1])
+
+
+def compute_breaks(values, scheme="percentiles", k=5):
+    """Cortes internos (k-1 valores) según el esquema."""
+    values = np.asarray(values, dtype=np.float64)
+    if scheme == "percentiles":
+        return np.quantile(values, DEFAULT_PERCENTILES)
+    if scheme == "quantile":
+        return quantile_breaks(values, k)
+    if scheme == "equal_interval":
+        return equal_interval_breaks(values, k)
+    if scheme == "natural_breaks":
+        return natural_breaks(values, k)
+    raise ValueError(f"Esquema de clasificación desconocido: {scheme}")
+
+
+def class_colors(k, palette=REDS):
+    """k colores hex interpolando la paleta."""
+    if k == len(palette):
+        return list(palette)
+    rgb = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in palette], dtype=float)
+    pos = np.linspace(0, 1, len(palette))
+    x = np.linspace(0, 1, k)
+    out = np.stack([np.interp(x, pos, rgb[:, ch]) for ch in range(3)], axis=1)
+    return ["#%02x%02x%02x" % tuple(int(round(c)) for c in row) for row in out]
+
+
+def classify(values, scheme="percentiles", k=5):
+    """
+    Devuelve (clases, cortes, colores).
+
+    `clases[i]` es el índice de clase de cada valor (NaN cuenta como 0), con la
+    misma regla `v <= corte` que usaba el estilo original.
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0)
+    breaks = compute_breaks(values, scheme, k)
+    classes = np.digitize(values, breaks, right=True)
+    return classes, breaks, class_colors(len(breaks) + 1)
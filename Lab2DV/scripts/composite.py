@@ -0,0 +1,162 @@
+"""
+Compuesto anual local a partir de escenas Sentinel-2 descargadas.
+
+`mask_clouds_array` es la versión NumPy de `gee_utils.mask_clouds`: descarta
+los píxeles con los bits 10 (nubes) u 11 (cirros) de QA60 y escala a
+reflectancia (/10000). `composite_scenes` arma un stack anual
+(`sentinel2_pudahuel_{año}.tif`) con la mediana o un percentil por píxel de
+todas las escenas, ignorando los píxeles enmascarados.
+
+Se procesa por bloques en un pool de procesos; el tamaño del bloque se elige
+para que escenas x bandas x bloque no pase de `max_block_mb` por proceso, y
+hay a lo sumo dos bloques por proceso en curso o esperando ser escritos.
+Las escenas con otra grilla se remuestrean a la de la primera al leerlas.
+
+    python scripts/composite.py --scenes data/raw/escenas/2024 --year 2024 --workers 4
+"""
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import click
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+
+from indices import DEFAULT_BAND_ORDER, OUTPUT_PROFILE, RAW_TEMPLATE
+from raster_io import bounded_map, iter_tiles
+
+logger = logging.getLogger(__name__)
+
+QA_BAND = "QA60"
+CLOUD_BIT = 10
+CIRRUS_BIT = 11
+REFLECTANCE_SCALE = 10000
+MAX_BLOCK_MB = 64
+
+
+def mask_clouds_array(bands, qa, nodata_mask=None):
+    """
+    Bandas (bandas, alto, ancho) en reflectancia, con NaN donde QA60 marca nubes o cirros.
+
+    `nodata_mask` (True = sin dato) se suma a la máscara de nubes.
+    """
+    cloudy = (qa.astype(np.uint16) & ((1 << CLOUD_BIT) | (1 << CIRRUS_BIT))) != 0
+    if nodata_mask is not None:
+        cloudy = cloudy | nodata_mask
+    out = bands.astype("float32") / REFLECTANCE_SCALE
+    out[:, cloudy] = np.nan
+    return out
+
+
+def scene_band_map(src):
+    """{banda: índice 1-based} de una escena; sin descripciones se asume el orden del export + QA60."""
+    names = [d for d in src.descriptions if d] if src.descriptions else []
+    if len(names) != src.count:
+        names = list(DEFAULT_BAND_ORDER[: src.count - 1]) + [QA_BAND]
+    return {name: i + 1 for i, name in enumerate(names)}
+
+
+def reduce_stack(stack, stat="median"):
+    """
+    Mediana (`"median"`) o percentil (`"p25"`, `"p75"`, ...) sobre el eje 0 ignorando NaN.
+
+    Da lo mismo que `np.nanmedian`/`np.nanpercentile` (interpolación lineal)
+    con un solo `np.sort`: los NaN quedan al final y el percentil se toma por
+    índice según la cantidad de valores válidos de cada píxel. NaN donde no
+    hay ninguno.
+    """
+    q = 50.0 if stat == "median" else float(stat[1:])
+    s = np.sort(stack, axis=0)
+    n = np.isfinite(s).sum(axis=0)
+    last = np.maximum(n - 1, 0)
+    pos = q / 100.0 * last
+    lo = np.floor(pos).astype(np.intp)
+    hi = np.minimum(lo + 1, last)
+    a = np.take_along_axis(s, lo[None], axis=0)[0]
+    b = np.take_along_axis(s, hi[None], axis=0)[0]
+    out = a + (b - a) * (pos - lo)
+    return np.where(n > 0, out, np.nan)
+
+
+def _open(path, grid):
+    src = rasterio.open(path)
+    if (src.crs, src.transform, src.width, src.height) == grid:
+        return src
+    crs, transform, width, height = grid
+    return WarpedVRT(src, crs=crs, transform=transform, width=width, height=height, resampling=Resampling.nearest)
+
+
+def _composite_window(args):
+    paths, grid, bands, window, stat = args
+    stack = np.full((len(paths), len(bands), window.height, window.width), np.nan, dtype="float32")
+    for k, path in enumerate(paths):
+        with _open(path, grid) as src:
+            band_idx = scene_band_map(src)
+            data = src.read([band_idx[b] for b in bands] + [band_idx[QA_BAND]], window=window, masked=True)
+        nodata = np.ma.getmaskarray(data).any(axis=0)
+        stack[k] = mask_clouds_array(data.data[:-1], data.data[-1], nodata)
+    return window, reduce_stack(stack, stat).astype("float32")
+
+
+def block_size(n_scenes, n_bands, max_block_mb=MAX_BLOCK_MB):
+    """Lado del bloque (múltiplo de 64, entre 64 y 1024) para no pasar de `max_block_mb`."""
+    side = math.isqrt(int(max_block_mb * 2 ** 20 / (n_scenes * n_bands * 4)))
+    return int(min(1024, max(64, side // 64 * 64)))
+
+
+def composite_scenes(scene_paths, out_path, stat="median", bands=DEFAULT_BAND_ORDER, pool=None,
+                     max_block_mb=MAX_BLOCK_MB):
+    """Escribe el compuesto de `scene_paths` en `out_path` (una banda por `bands`)."""
+    scene_paths = [str(p) for p in scene_paths]
+    if not scene_paths:
+        raise ValueError("No hay escenas para el compuesto")
+    if stat != "median" and not (stat.startswith("p") and 0 <= float(stat[1:]) <= 100):
+        raise ValueError(f"Estadístico no válido: {stat}")
+    with rasterio.open(scene_paths[0]) as ref:
+        grid = (ref.crs, ref.transform, ref.width, ref.height)
+        profile = dict(OUTPUT_PROFILE, count=len(bands), width=ref.width, height=ref.height,
+                       crs=ref.crs, transform=ref.transform)
+    for path in scene_paths:
+        with rasterio.open(path) as src:
+            missing = [b for b in (*bands, QA_BAND) if b not in scene_band_map(src)]
+        if missing:
+            raise ValueError(f"{Path(path).name}: faltan bandas {missing}")
+
+    size = block_size(len(scene_paths), len(bands) + 1, max_block_mb)
+    jobs = [(scene_paths, grid, list(bands), w, stat) for w in iter_tiles(grid[2], grid[3], size)]
+    results = bounded_map(pool, _composite_window, jobs)
+
+    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+    with rasterio.open(out_path, "w", **profile) as dst:
+        for i, band in enumerate(bands, start=1):
+            dst.set_band_description(i, band)
+        dst.update_tags(composite=stat, scenes=len(scene_paths))
+        for window, block in results:
+            dst.write(block, window=window)
+    return Path(out_path)
+
+
+@click.command()
+@click.option("--scenes", "scenes_dir", required=True, help="Directorio con las escenas .tif del año")
+@click.option("--year", required=True, type=int, help="Año del compuesto")
+@click.option("--output", "output_dir", default="data/raw", help="Directorio del stack anual")
+@click.option("--stat", default="median", help="median o un percentil (p25, p75, ...)")
+@click.option("--workers", default=None, type=int, help="Procesos (por defecto, núcleos disponibles)")
+@click.option("--max-block-mb", default=MAX_BLOCK_MB, type=int, help="Memoria por bloque y proceso")
+def main(scenes_dir, year, output_dir, stat, workers, max_block_mb):
+    """Arma el stack anual desde escenas locales con máscara QA60."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    scenes = sorted(Path(scenes_dir).glob("*.tif"))
+    out_path = Path(output_dir) / RAW_TEMPLATE.format(year=year)
+    logger.info(f"{len(scenes)} escenas -> {out_path} ({stat})")
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        composite_scenes(scenes, out_path, stat, pool=pool, max_block_mb=max_block_mb)
+    logger.info("Compuesto listo")
+
+
+if __name__ == "__main__":
+    main()
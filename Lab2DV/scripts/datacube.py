@@ -0,0 +1,249 @@
+"""
+Cubo espacio-temporal (año x índice x y x x) en un único archivo mapeado en memoria.
+
+El cubo se guarda teselado como `.npy` con forma
+(filas de teselas, columnas de teselas, años, índices, TILE, TILE): cada
+tesela contiene todos los años e índices de su bloque, contiguos en disco.
+Así una ventana de mapa (un año/índice dentro de una tesela) son TILE filas
+consecutivas y la serie temporal de un píxel queda en la misma región del
+archivo. Los accesores devuelven vistas del memmap, sin copiar, salvo
+cuando una ventana cruza teselas.
+
+    python scripts/datacube.py --input data/processed
+"""
+import json
+import logging
+import os
+from pathlib import Path
+
+import click
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.features import geometry_mask
+from rasterio.windows import Window, from_bounds
+
+from indices import INDICES, OUTPUT_TEMPLATE
+from raster_io import ensure_overviews, iter_tiles
+from raster_stats import RunningStats
+from raster_stretch import source_signature
+
+logger = logging.getLogger(__name__)
+
+TILE = 256
+CUBE_FILE = "cube.npy"
+META_FILE = "cube.json"
+
+
+def build_cube(products, out_dir, tile=TILE):
+    """
+    Empaqueta los productos {(año, índice): ruta} en `out_dir`.
+
+    Todos los rasters deben compartir grilla (CRS, transform y tamaño). Los
+    productos ausentes y el relleno del borde quedan como NaN.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    products = {k: Path(p) for k, p in products.items() if Path(p).exists()}
+    if not products:
+        raise FileNotFoundError("No hay productos para armar el cubo")
+    years = sorted({y for y, _ in products})
+    indices = sorted({i for _, i in products})
+
+    # Las overviews cambian el mtime: se construyen antes de registrar las firmas
+    for p in products.values():
+        ensure_overviews(p)
+
+    srcs = {k: rasterio.open(p) for k, p in products.items()}
+    try:
+        ref = next(iter(srcs.values()))
+        for k, src in srcs.items():
+            if (src.width, src.height, src.transform, src.crs) != (ref.width, ref.height, ref.transform, ref.crs):
+                raise ValueError(f"{products[k].name} no comparte la grilla del cubo")
+
+        ny, nx = -(-ref.height // tile), -(-ref.width // tile)
+        tmp = out_dir / (CUBE_FILE + ".tmp")
+        cube = np.lib.format.open_memmap(
+            tmp, mode="w+", dtype="float32", shape=(ny, nx, len(years), len(indices), tile, tile)
+        )
+        block = np.empty((len(years), len(indices), tile, tile), dtype="float32")
+        for window in iter_tiles(ref.width, ref.height, tile):
+            ty, tx = window.row_off // tile, window.col_off // tile
+            h, w = window.height, window.width
+            block.fill(np.nan)
+            for (y, i), src in srcs.items():
+                a = src.read(1, window=window, masked=True)
+                block[years.index(y), indices.index(i), :h, :w] = a.astype("float32").filled(np.nan)
+            cube[ty, tx] = block
+        cube.flush()
+        del cube
+        meta = {
+            "years": years,
+            "indices": indices,
+            "height": ref.height,
+            "width": ref.width,
+            "tile": tile,
+            "crs": ref.crs.to_wkt() if ref.crs else None,
+            "transform": list(ref.transform)[:6],
+            "sources": {
+                f"{i}/{y}": {"path": os.path.relpath(p, out_dir), **source_signature(p)}
+                for (y, i), p in products.items()
+            },
+        }
+    finally:
+        for src in srcs.values():
+            src.close()
+
+    os.replace(tmp, out_dir / CUBE_FILE)
+    (out_dir / META_FILE).write_text(json.dumps(meta, indent=1))
+    return SpaceTimeCube(out_dir)
+
+
+def open_cube(cube_dir):
+    """El cubo de `cube_dir`, o None si no se ha construido."""
+    cube_dir = Path(cube_dir)
+    if not ((cube_dir / CUBE_FILE).exists() and (cube_dir / META_FILE).exists()):
+        return None
+    return SpaceTimeCube(cube_dir)
+
+
+class SpaceTimeCube:
+    """Acceso de solo lectura al cubo mapeado en memoria."""
+
+    def __init__(self, cube_dir):
+        self.dir = Path(cube_dir)
+        self.meta = json.loads((self.dir / META_FILE).read_text())
+        self.data = np.load(self.dir / CUBE_FILE, mmap_mode="r")
+        self.years = self.meta["years"]
+        self.indices = self.meta["indices"]
+        self.height, self.width = self.meta["height"], self.meta["width"]
+        self.tile = self.meta["tile"]
+        self.transform = Affine(*self.meta["transform"])
+        self.crs = CRS.from_wkt(self.meta["crs"]) if self.meta["crs"] else None
+
+    def has(self, index, year=None):
+        if year is None:
+            return index in self.indices
+        return f"{index}/{year}" in self.meta["sources"]
+
+    def is_fresh(self):
+        """True si ningún raster de origen cambió desde que se armó el cubo."""
+        for src in self.meta["sources"].values():
+            path = self.dir / src["path"]
+            try:
+                sig = source_signature(path)
+            except OSError:
+                return False
+            if (sig["size"], sig["mtime_ns"]) != (src["size"], src["mtime_ns"]):
+                return False
+        return True
+
+    def _pos(self, year, index):
+        return self.years.index(year), self.indices.index(index)
+
+    def tile_view(self, ty, tx):
+        """Vista (años, índices, TILE, TILE) de una tesela."""
+        return self.data[ty, tx]
+
+    def band_tiles(self, year, index):
+        """Vista (filas, columnas de teselas, TILE, TILE) de un año/índice, con relleno NaN."""
+        yi, ii = self._pos(year, index)
+        return self.data[:, :, yi, ii]
+
+    def pixel_series(self, row, col, index=None):
+        """Serie temporal del píxel: vista (años, índices), o (años,) para un índice."""
+        ty, r = divmod(row, self.tile)
+        tx, c = divmod(col, self.tile)
+        if index is None:
+            return self.data[ty, tx, :, :, r, c]
+        return self.data[ty, tx, :, self.indices.index(index), r, c]
+
+    def window(self, year, index, window):
+        """
+        Arreglo (alto, ancho) de una ventana.
+
+        Si la ventana cae dentro de una tesela es una vista; si cruza teselas
+        se arma una copia.
+        """
+        return self.stack(index, window, years=[year])[0]
+
+    def stack(self, index, window, years=None):
+        """Arreglo (años, alto, ancho) de una ventana para varios años."""
+        years = self.years if years is None else years
+        yis = [self.years.index(y) for y in years]
+        ii = self.indices.index(index)
+        r0, c0 = int(window.row_off), int(window.col_off)
+        r1, c1 = r0 + int(window.height), c0 + int(window.width)
+        t = self.tile
+        ty0, ty1 = r0 // t, (r1 - 1) // t
+        tx0, tx1 = c0 // t, (c1 - 1) // t
+
+        if ty0 == ty1 and tx0 == tx1:
+            sel = slice(yis[0], yis[-1] + 1) if yis == list(range(yis[0], yis[-1] + 1)) else yis
+            return self.data[ty0, tx0, sel, ii, r0 - ty0 * t:r1 - ty0 * t, c0 - tx0 * t:c1 - tx0 * t]
+
+        out = np.empty((len(yis), r1 - r0, c1 - c0), dtype=self.data.dtype)
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                rs, re = max(r0, ty * t), min(r1, (ty + 1) * t)
+                cs, ce = max(c0, tx * t), min(c1, (tx + 1) * t)
+                out[:, rs - r0:re - r0, cs - c0:ce - c0] = self.data[
+                    ty, tx, yis, ii, rs - ty * t:re - ty * t, cs - tx * t:ce - tx * t
+                ]
+        return out
+
+    def year_stats(self, index):
+        """Filas {Año, Media, Std, Min, Max} como `raster_stats.year_stats`, leyendo del cubo."""
+        rows = []
+        for y in self.years:
+            if not self.has(index, y):
+                continue
+            stats = RunningStats()
+            tiles = self.band_tiles(y, index)
+            for ty in range(tiles.shape[0]):
+                stats.update(tiles[ty])
+            d = stats.to_dict()
+            rows.append({"Año": y, "Media": d["mean"], "Std": d["std"], "Min": d["min"], "Max": d["max"]})
+        return rows
+
+    def zone_series(self, geometry, index):
+        """Media por año de `index` dentro de `geometry` (en el CRS del cubo)."""
+        full = Window(0, 0, self.width, self.height)
+        win = from_bounds(*geometry.bounds, transform=self.transform).round_offsets().round_lengths()
+        try:
+            win = win.intersection(full)
+        except rasterio.errors.WindowError:
+            return {}
+        if win.width < 1 or win.height < 1:
+            return {}
+        data = self.stack(index, win)
+        inside = geometry_mask(
+            [geometry], out_shape=data.shape[1:], transform=rasterio.windows.transform(win, self.transform), invert=True
+        )
+        out = {}
+        for y, band in zip(self.years, data):
+            v = band[inside]
+            v = v[np.isfinite(v)]
+            out[y] = float(v.mean()) if v.size else np.nan
+        return out
+
+
+@click.command()
+@click.option("--input", "input_dir", default="data/processed", help="Directorio con los productos .tif")
+@click.option("--output", "output_dir", default=None, help="Directorio del cubo (por defecto <input>/cube)")
+@click.option("--years", default="2017,2019,2021,2024", help="Años separados por coma")
+@click.option("--indices", "names", default=",".join(INDICES), help="Índices separados por coma")
+def main(input_dir, output_dir, years, names):
+    """Arma el cubo espacio-temporal a partir de los productos por año."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    input_dir = Path(input_dir)
+    years = [int(y) for y in years.split(",") if y.strip()]
+    names = [n.strip().lower() for n in names.split(",") if n.strip()]
+    products = {(y, n): input_dir / OUTPUT_TEMPLATE.format(index=n, year=y) for y in years for n in names}
+    cube = build_cube(products, output_dir or input_dir / "cube")
+    logger.info(f"Cubo {cube.data.shape} con {len(cube.meta['sources'])} productos en {cube.dir}")
+
+
+if __name__ == "__main__":
+    main()
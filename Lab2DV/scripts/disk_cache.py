@@ -0,0 +1,228 @@
+"""
+Caché en disco compartido entre procesos para resultados de render.
+
+Las entradas se direccionan por contenido (hash de la huella de los archivos
+fuente + parámetros) y se guardan como `.npz` comprimido: arreglos NumPy más
+un diccionario de metadatos serializado en JSON. La escritura es atómica
+(archivo temporal + `os.replace`), por lo que las lecturas no necesitan
+bloqueo; las escrituras y la evicción LRU por tamaño se serializan con un
+lock de archivo, de modo que varias réplicas pueden compartir el directorio.
+
+Con otro `suffix` el mismo caché guarda archivos arbitrarios (p. ej. GeoTIFF
+calculados bajo demanda) mediante `get_path`/`put_file`. El último acceso
+(para la evicción LRU) se marca en un archivo aparte `<entrada>.atime`: el
+mtime de la entrada no cambia mientras su contenido no cambie, porque los
+sidecars de estadísticas y las huellas de otros cachés dependen de él.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+ENTRY_SUFFIX = ".npz"
+META_KEY = "__meta__"
+TMP_PREFIX = ".tmp-"
+ACCESS_SUFFIX = ".atime"
+
+
+def file_fingerprint(path, checksum=False):
+    """
+    Huella de un archivo: ruta, tamaño y mtime; con `checksum=True` además el
+    SHA1 del contenido (más caro, pero estable entre copias del archivo).
+    """
+    p = Path(path)
+    st = p.stat()
+    fp = {"name": p.name, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if checksum:
+        h = hashlib.sha1()
+        with open(p, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        fp["sha1"] = h.hexdigest()
+    return fp
+
+
+def make_key(*parts):
+    """Clave estable (SHA1) a partir de partes serializables a JSON."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def file_lock(lock_path):
+    """Lock exclusivo entre procesos sobre `lock_path`."""
+    with open(lock_path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class DiskCache:
+    """Caché LRU acotado por tamaño total en bytes."""
+
+    def __init__(self, root, max_bytes=512 * 2 ** 20, suffix=ENTRY_SUFFIX):
+        self.root = Path(root)
+        self.max_bytes = int(max_bytes)
+        self.suffix = suffix
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock_path = self.root / ".lock"
+
+    def _entry(self, key):
+        return self.root / key[:2] / f"{key}{self.suffix}"
+
+    def _touch(self, path):
+        try:
+            Path(f"{path}{ACCESS_SUFFIX}").touch()
+        except OSError:
+            pass
+
+    def get_path(self, key):
+        """Ruta de una entrada de archivo si existe (marcándola como usada), o None."""
+        path = self._entry(key)
+        if not path.is_file():
+            return None
+        self._touch(path)
+        return path
+
+    def put_file(self, key, write):
+        """
+        Crea una entrada de archivo: `write(ruta_temporal)` escribe el contenido,
+        que luego se publica de forma atómica. Devuelve la ruta final.
+        """
+        path = self._entry(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Temporal oculto pero con la extensión real (algunos drivers la exigen)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=TMP_PREFIX, suffix=self.suffix)
+        os.close(fd)
+        try:
+            write(tmp)
+            with file_lock(self._lock_path):
+                os.replace(tmp, path)
+                self._evict()
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return path
+
+    def get(self, key):
+        """Devuelve (arrays, meta) o None si la entrada no existe o está corrupta."""
+        path = self._entry(key)
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                arrays = {k: z[k] for k in z.files if k != META_KEY}
+                meta = json.loads(z[META_KEY].tobytes().decode("utf-8")) if META_KEY in z.files else {}
+        except (OSError, ValueError, KeyError):
+            return None
+        self._touch(path)
+        return arrays, meta
+
+    def put(self, key, arrays=None, meta=None):
+        """Guarda arreglos + metadatos de forma atómica y aplica la evicción."""
+        path = self._entry(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = dict(arrays or {})
+        payload[META_KEY] = np.frombuffer(json.dumps(meta or {}).encode("utf-8"), dtype=np.uint8)
+
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **payload)
+            with file_lock(self._lock_path):
+                os.replace(tmp, path)
+                self._evict()
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def entries(self):
+        """Lista (ruta, tamaño, último acceso) de todas las entradas."""
+        out = []
+        for p in self.root.glob(f"*/*{self.suffix}"):
+            if p.name.startswith(TMP_PREFIX):
+                continue
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            try:
+                last = max(st.st_mtime, os.stat(f"{p}{ACCESS_SUFFIX}").st_mtime)
+            except OSError:
+                last = st.st_mtime
+            out.append((p, st.st_size, last))
+        return out
+
+    def size_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def _evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for p, size, _ in sorted(entries, key=lambda e: e[2]):
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            _remove_companions(p)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with file_lock(self._lock_path):
+            for p, _, _ in self.entries():
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+                _remove_companions(p)
+
+
+def _remove_companions(path):
+    # Archivos asociados a una entrada (p. ej. `<entrada>.tif.stats.json`)
+    for p in path.parent.glob(path.name + ".*"):
+        try:
+            p.unlink()
+        except OSError:
+            pass
+
+
+def cached_call(cache, key, compute, to_payload, from_payload):
+    """
+    Patrón get-or-compute: busca `key` en `cache` y, si no está, ejecuta
+    `compute()` y guarda `to_payload(result)` -> (arrays, meta).
+    """
+    if cache is not None:
+        hit = cache.get(key)
+        if hit is not None:
+            return from_payload(*hit)
+    result = compute()
+    if cache is not None:
+        try:
+            cache.put(key, *to_payload(result))
+        except OSError:
+            pass
+    return result
@@ -0,0 +1,150 @@
+"""
+Exportaciones de la capa de zonas, filtradas y bajo demanda.
+
+Los filtros (rango de zone_id, bbox WGS84, umbral de una métrica) se pasan
+al lector (`bbox` y `where` de OGR), así solo se leen las zonas pedidas. El
+archivo se escribe por bloques a disco y queda en un caché LRU
+(`DiskCache`), de modo que la app entrega un archivo en vez de mantener los
+bytes en memoria por sesión.
+
+Formatos: CSV, GeoPackage, FlatGeobuf y, si está instalado `pyarrow`,
+Parquet (sin geometría) y GeoParquet.
+"""
+import csv
+import re
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import box
+
+from disk_cache import DiskCache, file_fingerprint, make_key
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # dependencia opcional
+    pyarrow = None
+
+CHUNK_ROWS = 50_000
+# Incrementar al cambiar el contenido de las exportaciones para invalidar el caché
+EXPORT_VERSION = 1
+
+
+def parquet_available():
+    return pyarrow is not None
+
+
+def zone_filter(zone_range=None, bbox=None, metric=None, threshold=None):
+    """Filtro serializable: rango de zone_id, bbox (minx, miny, maxx, maxy) WGS84 y métrica >= umbral."""
+    return {
+        "zone_range": list(zone_range) if zone_range else None,
+        "bbox": list(bbox) if bbox else None,
+        "metric": metric if threshold is not None else None,
+        "threshold": threshold if metric else None,
+    }
+
+
+def _where(filt):
+    clauses = []
+    if filt.get("zone_range"):
+        lo, hi = filt["zone_range"]
+        clauses.append(f"zone_id >= {int(lo)} AND zone_id <= {int(hi)}")
+    if filt.get("metric"):
+        # El nombre de la columna va en SQL: solo identificadores simples
+        if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", filt["metric"]):
+            raise ValueError(f"Columna no válida: {filt['metric']}")
+        clauses.append(f'"{filt["metric"]}" >= {float(filt["threshold"])}')
+    return " AND ".join(clauses) or None
+
+
+def read_zones(path, filt=None, columns=None):
+    """Lee solo las zonas (y columnas) que pasan el filtro, en WGS84."""
+    filt = filt or {}
+    kwargs = {}
+    where = _where(filt)
+    if where:
+        kwargs["where"] = where
+    if columns is not None:
+        kwargs["columns"] = columns
+    if filt.get("bbox"):
+        # El bbox de OGR va en el CRS de la capa; se reproyecta el rectángulo con
+        # los bordes densificados (~20 tramos por lado), no solo las esquinas
+        crs = gpd.read_file(path, rows=0).crs
+        minx, miny, maxx, maxy = filt["bbox"]
+        rect = gpd.GeoSeries([box(minx, miny, maxx, maxy)], crs="EPSG:4326")
+        rect = rect.segmentize(max(maxx - minx, maxy - miny) / 20 or 1)
+        kwargs["bbox"] = tuple(rect.to_crs(crs).total_bounds) if crs else tuple(filt["bbox"])
+    gdf = gpd.read_file(path, **kwargs)
+    if gdf.crs is not None:
+        gdf = gdf.to_crs("EPSG:4326")
+    if filt.get("bbox"):
+        # OGR filtra por envolvente; se refina con la intersección exacta
+        gdf = gdf[gdf.intersects(box(*filt["bbox"]))]
+    return gdf
+
+
+def _write_csv(gdf, out):
+    df = pd.DataFrame(gdf.drop(columns="geometry", errors="ignore"))
+    with open(out, "w", newline="", encoding="utf-8") as f:
+        if df.empty:
+            csv.writer(f).writerow(df.columns)
+        for start in range(0, len(df), CHUNK_ROWS):
+            df.iloc[start:start + CHUNK_ROWS].to_csv(f, header=start == 0, index=False)
+
+
+def _write_parquet(gdf, out):
+    df = pd.DataFrame(gdf.drop(columns="geometry", errors="ignore"))
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(out, table.schema, compression="zstd") as writer:
+        for batch in table.to_batches(max_chunksize=CHUNK_ROWS):
+            writer.write_batch(batch)
+
+
+def _write_geoparquet(gdf, out):
+    gdf.to_parquet(out, index=False, compression="zstd", row_group_size=CHUNK_ROWS)
+
+
+def _write_ogr(driver):
+    return lambda gdf, out: gdf.to_file(out, driver=driver, layer="zonas")
+
+
+# formato -> (extensión, MIME, escritor, requiere pyarrow)
+FORMATS = {
+    "CSV": (".csv", "text/csv", _write_csv, False),
+    "GeoPackage": (".gpkg", "application/geopackage+sqlite3", _write_ogr("GPKG"), False),
+    "FlatGeobuf": (".fgb", "application/octet-stream", _write_ogr("FlatGeobuf"), False),
+    "Parquet": (".parquet", "application/vnd.apache.parquet", _write_parquet, True),
+    "GeoParquet": (".parquet", "application/vnd.apache.parquet", _write_geoparquet, True),
+}
+
+
+def available_formats():
+    return [name for name, (*_, needs_arrow) in FORMATS.items() if parquet_available() or not needs_arrow]
+
+
+class ZoneExporter:
+    """Genera exportaciones filtradas en un caché LRU en disco (un subdirectorio por extensión)."""
+
+    def __init__(self, source, cache_dir, max_bytes=512 * 2 ** 20):
+        self.source = Path(source)
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._caches = {}
+
+    def _cache(self, suffix):
+        if suffix not in self._caches:
+            self._caches[suffix] = DiskCache(self.cache_dir / suffix.lstrip("."), self.max_bytes, suffix=suffix)
+        return self._caches[suffix]
+
+    def export(self, fmt, filt=None):
+        """Ruta del archivo exportado en formato `fmt` con el filtro `filt`."""
+        suffix, _, write, _ = FORMATS[fmt]
+        filt = filt or zone_filter()
+        cache = self._cache(suffix)
+        key = make_key(EXPORT_VERSION, fmt, file_fingerprint(self.source), filt)
+        path = cache.get_path(key)
+        if path is None:
+            gdf = read_zones(self.source, filt)
+            path = cache.put_file(key, lambda out: write(gdf, out))
+        return path
@@ -0,0 +1,381 @@
+"""
+Exportación por lotes de los compuestos anuales Sentinel-2 desde Earth Engine.
+
+Todas las exportaciones se envían de una vez y cada una se sigue en su propio
+hilo (consulta de estado con espera exponencial), así adquirir N años tarda
+lo que la exportación más lenta y no la suma. Las descargas corren en
+paralelo con un límite propio. El avance queda en un archivo de estado JSON:
+si la corrida se interrumpe, al repetirla se retoman las tareas ya enviadas y
+se omiten los años ya descargados (mientras no cambien sus parámetros).
+
+El acceso a Earth Engine pasa por `EEClient`; `EarthEngineClient` es la
+implementación real (exporta a Cloud Storage y descarga con
+`google-cloud-storage`) y `FakeEEClient` la simula en local para pruebas y
+ensayos sin credenciales.
+
+    python scripts/gee_export.py --project mi-proyecto --bucket mi-bucket --years 2017,2019,2021,2024
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import click
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.transform import from_origin
+
+from disk_cache import make_key
+from indices import DEFAULT_BAND_ORDER, RAW_TEMPLATE
+
+logger = logging.getLogger(__name__)
+
+DONE_STATES = ("COMPLETED",)
+FAILED_STATES = ("FAILED", "CANCELLED")
+STATE_FILE = "gee_exports.json"
+
+
+def _backoff(attempt, base, cap):
+    """Espera exponencial con jitter (entre la mitad y el total del intervalo)."""
+    delay = min(cap, base * 2 ** attempt)
+    return delay * (0.5 + random.random() / 2)
+
+
+def export_params(roi_geojson, year, bands=DEFAULT_BAND_ORDER, scale=10, crs=None, **extra):
+    """Parámetros serializables de una exportación anual (también definen su clave)."""
+    return {"roi": roi_geojson, "year": int(year), "bands": list(bands), "scale": scale, "crs": crs, **extra}
+
+
+# -----------------------------
+# Clientes
+# -----------------------------
+class EEClient(ABC):
+    """Interfaz mínima de Earth Engine que usa `ExportManager`."""
+
+    @abstractmethod
+    def submit(self, name, params):
+        """Inicia la exportación y devuelve el id de la tarea."""
+
+    @abstractmethod
+    def status(self, task_id):
+        """{"state": ..., "error": ...} con los estados de Earth Engine (READY, RUNNING, COMPLETED, ...)."""
+
+    @abstractmethod
+    def download(self, task_id, name, params, out_path):
+        """Descarga el resultado de una tarea completada en `out_path`."""
+
+
+class EarthEngineClient(EEClient):
+    """Exporta a Cloud Storage (`gs://bucket/prefix/`) y descarga con google-cloud-storage."""
+
+    def __init__(self, project, bucket, prefix="geolab"):
+        import ee
+
+        from gee_utils import autenticar_gee
+
+        autenticar_gee(project)
+        self.ee = ee
+        self.project = project
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _file_prefix(self, name, params):
+        return f"{self.prefix}/{name}_{make_key(params)[:8]}"
+
+    def submit(self, name, params):
+        from gee_utils import composite_anual
+
+        ee = self.ee
+        roi = ee.Geometry(params["roi"])
+        image = composite_anual(roi, params["year"], params["bands"])
+        # Con grilla explícita (teselas) se exporta exactamente ese bloque de píxeles
+        if params.get("crs_transform"):
+            grid = {"crsTransform": params["crs_transform"], "dimensions": "{}x{}".format(*params["dimensions"])}
+        else:
+            grid = {"region": roi, "scale": params["scale"]}
+        task = ee.batch.Export.image.toCloudStorage(
+            image=image.toFloat(),
+            description=name[:100],
+            bucket=self.bucket,
+            fileNamePrefix=self._file_prefix(name, params),
+            crs=params["crs"],
+            maxPixels=1e13,
+            formatOptions={"cloudOptimized": True},
+            **grid,
+        )
+        task.start()
+        return task.id
+
+    def status(self, task_id):
+        info = self.ee.data.getTaskStatus(task_id)[0]
+        return {"state": info.get("state", "UNKNOWN"), "error": info.get("error_message")}
+
+    def download(self, task_id, name, params, out_path):
+        from google.cloud import storage
+
+        prefix = self._file_prefix(name, params)
+        blobs = sorted(
+            (b for b in storage.Client(project=self.project).list_blobs(self.bucket, prefix=prefix)
+             if b.name.endswith(".tif")),
+            key=lambda b: b.name,
+        )
+        if not blobs:
+            raise FileNotFoundError(f"gs://{self.bucket}/{prefix}*.tif no existe")
+        if len(blobs) == 1:
+            blobs[0].download_to_filename(out_path)
+            return
+        # Earth Engine parte las imágenes grandes en varios archivos: se unen en uno
+        from rasterio.merge import merge
+
+        parts = []
+        try:
+            for i, blob in enumerate(blobs):
+                part = Path(f"{out_path}.part{i}")
+                blob.download_to_filename(part)
+                parts.append(part)
+            merge([str(p) for p in parts], dst_path=out_path, dst_kwds={"tiled": True, "compress": "deflate"})
+        finally:
+            for part in parts:
+                part.unlink(missing_ok=True)
+
+
+class FakeEEClient(EEClient):
+    """
+    Cliente local: cada tarea "corre" `durations[año]` segundos y produce un
+    GeoTIFF sintético. `failures[año]` es cuántas veces falla antes de completar.
+    """
+
+    def __init__(self, durations=None, failures=None, size=64):
+        self.durations = durations or {}
+        self.failures = dict(failures or {})
+        self.size = size
+        self.tasks = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, params):
+        with self._lock:
+            task_id = f"FAKE_{len(self.tasks)}"
+            year = params["year"]
+            fail = self.failures.get(year, 0) > 0
+            if fail:
+                self.failures[year] -= 1
+            self.tasks[task_id] = (time.monotonic() + self.durations.get(year, 0.1), fail)
+        return task_id
+
+    def status(self, task_id):
+        ends, fail = self.tasks[task_id]
+        if time.monotonic() < ends:
+            return {"state": "RUNNING", "error": None}
+        return {"state": "FAILED", "error": "fallo simulado"} if fail else {"state": "COMPLETED", "error": None}
+
+    def download(self, task_id, name, params, out_path):
+        bands = len(params["bands"])
+        if params.get("crs_transform"):
+            width, height = params["dimensions"]
+            transform = Affine(*params["crs_transform"])
+        else:
+            width = height = self.size
+            transform = from_origin(330000, 6300000, params["scale"], params["scale"])
+        rng = np.random.default_rng(params["year"])
+        data = rng.uniform(0, 0.4, (bands, height, width)).astype("float32")
+        profile = {
+            "driver": "GTiff", "dtype": "float32", "count": bands, "width": width, "height": height,
+            "crs": params["crs"] or "EPSG:32719", "transform": transform,
+        }
+        with rasterio.open(out_path, "w", **profile) as dst:
+            dst.write(data)
+            for i, band in enumerate(params["bands"], start=1):
+                dst.set_band_description(i, band)
+
+
+# -----------------------------
+# Gestor de exportaciones
+# -----------------------------
+class ExportState:
+    """Archivo de estado JSON {nombre: {...}} escrito de forma atómica tras cada cambio."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.entries = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    def get(self, name):
+        with self._lock:
+            return dict(self.entries.get(name, {}))
+
+    def update(self, name, **fields):
+        with self._lock:
+            self.entries.setdefault(name, {}).update(fields)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.entries, indent=1))
+            os.replace(tmp, self.path)
+
+
+class ExportManager:
+    """
+    Envía, sigue y descarga un lote de exportaciones {nombre: parámetros}.
+
+    Los errores transitorios (red, cuotas) al enviar, consultar o descargar se
+    reintentan con espera exponencial; una tarea que termina en FAILED se
+    reenvía hasta `max_retries` veces. `validate(nombre, parámetros, ruta)`,
+    si se entrega, revisa cada descarga y lanza una excepción si no sirve (se
+    vuelve a descargar).
+    """
+
+    def __init__(self, client, out_dir, state_path=None, download_workers=2, poll_interval=10.0,
+                 max_poll_interval=120.0, max_retries=3, timeout=6 * 3600, validate=None):
+        self.client = client
+        self.out_dir = Path(out_dir)
+        self.state = ExportState(state_path or self.out_dir / STATE_FILE)
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.validate = validate
+        self._downloads = threading.Semaphore(download_workers)
+
+    def _call(self, what, fn, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return fn(*args)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = _backoff(attempt, self.poll_interval, self.max_poll_interval)
+                logger.warning(f"{what}: {e} (reintento en {delay:.1f}s)")
+                time.sleep(delay)
+
+    def _wait(self, name, task_id):
+        """Consulta el estado hasta que la tarea termina; devuelve el estado final."""
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            status = self._call(f"{name}: estado", self.client.status, task_id)
+            if status["state"] in DONE_STATES + FAILED_STATES:
+                return status
+            if time.monotonic() - start > self.timeout:
+                raise TimeoutError(f"{name}: la tarea {task_id} no terminó en {self.timeout}s")
+            self.state.update(name, state=status["state"])
+            time.sleep(_backoff(attempt, self.poll_interval, self.max_poll_interval))
+            attempt += 1
+
+    def _run_one(self, name, params):
+        key = make_key(params)
+        out_path = self.out_dir / f"{name}.tif"
+        entry = self.state.get(name)
+        if entry.get("key") != key:
+            entry = {}
+        if entry.get("state") == "DOWNLOADED" and out_path.exists():
+            logger.info(f"{name}: ya descargado")
+            return out_path
+
+        t0 = time.monotonic()
+        retries = entry.get("retries", 0)
+        task_id = entry.get("task_id") if entry.get("state") not in FAILED_STATES else None
+        while True:
+            if task_id is None:
+                task_id = self._call(f"{name}: envío", self.client.submit, name, params)
+                self.state.update(name, key=key, task_id=task_id, state="SUBMITTED", retries=retries, error=None)
+                logger.info(f"{name}: enviada ({task_id})")
+            else:
+                logger.info(f"{name}: retomando {task_id}")
+            status = self._wait(name, task_id)
+            if status["state"] in DONE_STATES:
+                break
+            self.state.update(name, state=status["state"], error=status["error"])
+            retries += 1
+            if retries > self.max_retries:
+                raise RuntimeError(f"{name}: {status['state']} ({status['error']})")
+            logger.warning(f"{name}: {status['state']} ({status['error']}), reenviando ({retries}/{self.max_retries})")
+            task_id = None
+
+        self.state.update(name, state="COMPLETED")
+        with self._downloads:
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            tmp = out_path.with_suffix(".tif.tmp")
+            self._call(f"{name}: descarga", self._download, task_id, name, params, tmp)
+            os.replace(tmp, out_path)
+        self.state.update(name, state="DOWNLOADED", path=str(out_path))
+        logger.info(f"{name}: descargado en {time.monotonic() - t0:.1f}s -> {out_path}")
+        return out_path
+
+    def _download(self, task_id, name, params, path):
+        self.client.download(task_id, name, params, path)
+        if self.validate is not None:
+            self.validate(name, params, path)
+
+    def run(self, jobs, max_workers=None):
+        """
+        Ejecuta las exportaciones y devuelve {nombre: ruta o excepción}.
+
+        Por defecto todas quedan en curso a la vez; `max_workers` limita cuántas
+        (p. ej. con cientos de teselas, por la cuota de tareas de Earth Engine).
+        """
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(len(jobs), max_workers or len(jobs)))) as pool:
+            futures = {pool.submit(self._run_one, name, params): name for name, params in jobs.items()}
+            for fut, name in futures.items():
+                try:
+                    results[name] = fut.result()
+                except Exception as e:
+                    logger.error(f"{name}: {e}")
+                    self.state.update(name, error=str(e))
+                    results[name] = e
+        return results
+
+
+def year_jobs(years, roi_geojson, **params):
+    """Trabajos {sentinel2_pudahuel_<año>: parámetros} para los años pedidos."""
+    return {Path(RAW_TEMPLATE.format(year=y)).stem: export_params(roi_geojson, y, **params) for y in years}
+
+
+def load_roi(path):
+    """Geometría (GeoJSON) de la ROI, unida si el archivo trae varias entidades."""
+    import geopandas as gpd
+    from shapely.geometry import mapping
+
+    gdf = gpd.read_file(path).to_crs("EPSG:4326")
+    return mapping(gdf.union_all())
+
+
+@click.command()
+@click.option("--project", default=None, help="Proyecto de Google Cloud para Earth Engine")
+@click.option("--bucket", default=None, help="Bucket de Cloud Storage para las exportaciones")
+@click.option("--years", default="2017,2019,2021,2024", help="Años separados por coma")
+@click.option("--roi", "roi_path", default="data/vector/pudahuel_roi.geojson", help="Polígono de la ROI")
+@click.option("--output", "output_dir", default="data/raw", help="Directorio de descarga")
+@click.option("--scale", default=10, type=int, help="Resolución en metros")
+@click.option("--crs", default="EPSG:32719", help="CRS de salida")
+@click.option("--download-workers", default=2, type=int, help="Descargas en paralelo")
+@click.option("--poll", "poll_interval", default=10.0, type=float, help="Intervalo inicial de consulta (s)")
+@click.option("--fake", is_flag=True, help="Simula Earth Engine en local (ensayos sin credenciales)")
+def main(project, bucket, years, roi_path, output_dir, scale, crs, download_workers, poll_interval, fake):
+    """Exporta y descarga los compuestos anuales, retomando corridas previas."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    years = [int(y) for y in years.split(",") if y.strip()]
+    if fake:
+        client = FakeEEClient()
+    elif project and bucket:
+        client = EarthEngineClient(project, bucket)
+    else:
+        raise click.UsageError("Se requieren --project y --bucket (o --fake)")
+
+    jobs = year_jobs(years, load_roi(roi_path), scale=scale, crs=crs)
+    manager = ExportManager(client, output_dir, download_workers=download_workers, poll_interval=poll_interval)
+    t0 = time.monotonic()
+    results = manager.run(jobs)
+    failed = [name for name, r in results.items() if isinstance(r, Exception)]
+    logger.info(f"{len(results) - len(failed)}/{len(results)} exportaciones en {time.monotonic() - t0:.1f}s")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,3 +18,13 @@ def mask_clouds(image):
     mask = qa.bitwiseAnd(cloud_bit_mask).eq(0).And(
            qa.bitwiseAnd(cirrus_bit_mask).eq(0))
     return image.updateMask(mask).divide(10000)
+
+def composite_anual(roi, anio, bandas=("B2", "B3", "B4", "B8", "B11", "B12"),
+                    inicio="01-01", fin="12-31", max_nubes=20):
+    """Mediana anual Sentinel-2 SR enmascarada por nubes y recortada a la ROI."""
+    coleccion = (ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")
+                 .filterBounds(roi)
+                 .filterDate(f"{anio}-{inicio}", f"{anio}-{fin}")
+                 .filter(ee.Filter.lt("CLOUDY_PIXEL_PERCENTAGE", max_nubes))
+                 .map(mask_clouds))
+    return coleccion.median().select(list(bandas)).clip(roi)
@@ -0,0 +1,232 @@
+"""
+Caché HTTP compartido para las respuestas de Nominatim/Overpass (osmnx).
+
+osmnx guarda cada respuesta como `<sha1 de la URL>.json` en `./cache`, es
+decir, en una carpeta distinta según desde dónde se ejecute (notebooks, app,
+scripts) y sin comprimir. Este módulo reemplaza ese almacenamiento por uno
+solo (`GEOLAB_HTTP_CACHE`, por defecto `~/.cache/geolab/http`) sobre
+`DiskCache`:
+
+- entradas comprimidas (`.json.gz`) con la misma clave que osmnx,
+- vencimiento (TTL) por fecha de descarga,
+- tamaño máximo con evicción LRU,
+- escritura atómica y lock entre procesos, para compartirlo entre notebooks,
+  scripts y la app a la vez.
+
+    from http_cache import install_osmnx_cache
+    install_osmnx_cache()            # antes de usar osmnx
+
+    python scripts/http_cache.py stats
+    python scripts/http_cache.py prune
+    python scripts/http_cache.py migrate --remove   # importa las carpetas cache/ antiguas
+"""
+import gzip
+import hashlib
+import importlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import click
+
+from disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parents[2]
+DEFAULT_DIR = Path(os.getenv("GEOLAB_HTTP_CACHE", str(Path.home() / ".cache" / "geolab" / "http")))
+DEFAULT_MAX_MB = int(os.getenv("GEOLAB_HTTP_CACHE_MAX_MB", "512"))
+DEFAULT_TTL_DAYS = float(os.getenv("GEOLAB_HTTP_CACHE_TTL_DAYS", "365"))
+ENTRY_SUFFIX = ".json.gz"
+
+# Módulos donde osmnx define `_retrieve_from_cache`/`_save_to_cache`, según la versión
+OSMNX_CACHE_MODULES = ("osmnx._http", "osmnx._downloader", "osmnx.downloader")
+
+# Carpetas `cache/` que osmnx dejó en el repositorio
+LEGACY_DIRS = ("LabDV/notebooks/cache", "LabDV/app/cache", "Lab2DV/notebooks/cache", "Lab2DV/app/cache")
+
+
+def url_key(url):
+    """Clave de una URL, la misma que usa osmnx para nombrar sus archivos."""
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+class HttpCache(DiskCache):
+    """Respuestas JSON comprimidas, con vencimiento y tamaño máximo."""
+
+    def __init__(self, root=DEFAULT_DIR, max_bytes=DEFAULT_MAX_MB * 2 ** 20, ttl=DEFAULT_TTL_DAYS * 86400):
+        super().__init__(root, max_bytes, suffix=ENTRY_SUFFIX)
+        self.ttl = ttl
+
+    def _read(self, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def expired(self, entry):
+        return self.ttl is not None and time.time() - entry.get("created", 0) > self.ttl
+
+    def get_json(self, key):
+        """Cuerpo de la respuesta guardada con `key`, o None si no está o venció."""
+        path = self._entry(key)
+        try:
+            entry = self._read(path)
+        except (OSError, ValueError, EOFError):
+            return None
+        if self.expired(entry):
+            return None
+        self._touch(path)
+        return entry["body"]
+
+    def put_json(self, key, body, url=None, created=None):
+        entry = {"url": url, "created": created or time.time(), "body": body}
+
+        def write(tmp):
+            with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+                json.dump(entry, f)
+
+        return self.put_file(key, write)
+
+    def prune(self, max_bytes=None):
+        """Borra las entradas vencidas o ilegibles y, con `max_bytes`, las menos usadas hasta caber."""
+        removed = freed = 0
+        for path, size, _ in self.entries():
+            try:
+                stale = self.expired(self._read(path))
+            except (OSError, ValueError, EOFError):
+                stale = True
+            if stale:
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                removed, freed = removed + 1, freed + size
+        if max_bytes is not None:
+            before = self.entries()
+            self.max_bytes = int(max_bytes)
+            self._evict()
+            after = {p for p, _, _ in self.entries()}
+            gone = [(p, size) for p, size, _ in before if p not in after]
+            removed, freed = removed + len(gone), freed + sum(size for _, size in gone)
+        return removed, freed
+
+    def stats(self):
+        entries = self.entries()
+        expired = 0
+        for path, _, _ in entries:
+            try:
+                expired += self.expired(self._read(path))
+            except (OSError, ValueError, EOFError):
+                expired += 1
+        return {
+            "dir": str(self.root),
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "expired": expired,
+            "ttl_days": self.ttl / 86400 if self.ttl is not None else None,
+        }
+
+
+def install_osmnx_cache(cache=None):
+    """
+    Hace que osmnx lea y guarde sus respuestas en `cache` (por defecto el caché compartido).
+
+    Reemplaza las funciones internas de caché de osmnx (`_http` desde 2.0,
+    `_downloader` en 1.8/1.9, `downloader` antes). Devuelve el caché
+    instalado, o None si esta versión de osmnx no las tiene.
+    """
+    import osmnx as ox
+
+    cache = cache or HttpCache()
+    for name in OSMNX_CACHE_MODULES:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        if hasattr(module, "_retrieve_from_cache") and hasattr(module, "_save_to_cache"):
+            break
+    else:
+        logger.warning(f"osmnx {getattr(ox, '__version__', '?')} no tiene funciones de caché conocidas; "
+                       "se usa su caché propio")
+        return None
+
+    def retrieve(url, *args, **kwargs):
+        return cache.get_json(url_key(url))
+
+    def save(url, response_json, ok, *args, **kwargs):
+        # osmnx pasa un bool (2.x) o el código HTTP (1.x); las respuestas con
+        # "remark" son errores de Overpass (p. ej. timeout) y no se guardan
+        if ok not in (True, 200) or (isinstance(response_json, dict) and "remark" in response_json):
+            return
+        try:
+            cache.put_json(url_key(url), response_json, url)
+        except OSError:
+            pass
+
+    module._retrieve_from_cache = retrieve
+    module._save_to_cache = save
+    ox.settings.use_cache = True
+    return cache
+
+
+@click.group()
+@click.option("--dir", "cache_dir", default=str(DEFAULT_DIR), help="Directorio del caché")
+@click.option("--ttl-days", default=DEFAULT_TTL_DAYS, type=float, help="Días de validez de una respuesta")
+@click.pass_context
+def main(ctx, cache_dir, ttl_days):
+    """Administra el caché HTTP compartido."""
+    ctx.obj = HttpCache(cache_dir, ttl=ttl_days * 86400)
+
+
+@main.command()
+@click.pass_obj
+def stats(cache):
+    """Muestra entradas, tamaño y vencidas."""
+    s = cache.stats()
+    click.echo(f"{s['dir']}: {s['entries']} entradas, {s['bytes'] / 2 ** 20:.1f} MB "
+               f"de {s['max_bytes'] / 2 ** 20:.0f} MB, {s['expired']} vencidas (TTL {s['ttl_days']:g} días)")
+
+
+@main.command()
+@click.option("--max-mb", default=None, type=float, help="Además, reducir a este tamaño (LRU)")
+@click.pass_obj
+def prune(cache, max_mb):
+    """Borra entradas vencidas (y las menos usadas con --max-mb)."""
+    removed, freed = cache.prune(max_mb * 2 ** 20 if max_mb is not None else None)
+    click.echo(f"{removed} entradas borradas, {freed / 2 ** 20:.1f} MB liberados")
+
+
+@main.command()
+@click.option("--remove", is_flag=True, help="Borrar los archivos antiguos una vez importados")
+@click.argument("dirs", nargs=-1)
+@click.pass_obj
+def migrate(cache, remove, dirs):
+    """Importa carpetas cache/ de osmnx (por defecto las del repositorio)."""
+    dirs = [Path(d) for d in dirs] or [ROOT / d for d in LEGACY_DIRS]
+    imported = skipped = stale = before = 0
+    for d in dirs:
+        for path in sorted(d.glob("*.json")):
+            st = path.stat()
+            before += st.st_size
+            # Se conserva la fecha de descarga original (mtime) para el TTL
+            if cache.expired({"created": st.st_mtime}):
+                stale += 1
+            elif cache.get_path(path.stem) is None:
+                try:
+                    body = json.loads(path.read_text(encoding="utf-8"))
+                except (OSError, ValueError):
+                    continue
+                cache.put_json(path.stem, body, created=st.st_mtime)
+                imported += 1
+            else:
+                skipped += 1
+            if remove:
+                path.unlink()
+    click.echo(f"{imported} importadas, {skipped} repetidas, {stale} vencidas; {before / 2 ** 20:.1f} MB -> "
+               f"{cache.size_bytes() / 2 ** 20:.1f} MB en {cache.root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Motor de índices espectrales multi-índice y multi-año.
+
+Cada stack Sentinel-2 (`data/raw/sentinel2_pudahuel_{año}.tif`) se lee una
+sola vez, por ventanas; en cada ventana se calculan todos los índices en una
+pasada vectorizada. Las ventanas se reparten en un pool de procesos y el
+proceso principal escribe GeoTIFF teselados y comprimidos.
+
+    python scripts/indices.py --years 2017,2019,2021,2024 --workers 4
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import click
+import numpy as np
+import rasterio
+
+from raster_io import bounded_map, iter_tiles
+from raster_stats import write_stats_sidecar
+
+logger = logging.getLogger(__name__)
+
+RAW_TEMPLATE = "sentinel2_pudahuel_{year}.tif"
+OUTPUT_TEMPLATE = "{index}_pudahuel_{year}.tif"
+
+# Orden de bandas del export de GEE si el archivo no trae descripciones
+DEFAULT_BAND_ORDER = ("B2", "B3", "B4", "B8", "B11", "B12")
+
+WINDOW_SIZE = 512
+
+OUTPUT_PROFILE = {
+    "driver": "GTiff",
+    "dtype": "float32",
+    "count": 1,
+    "nodata": np.nan,
+    "tiled": True,
+    "blockxsize": 256,
+    "blockysize": 256,
+    "compress": "deflate",
+    "predictor": 3,
+    "BIGTIFF": "IF_SAFER",
+}
+
+
+def _normalized_difference(a, b):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return ((a - b) / (a + b)).astype("float32")
+
+
+# Registro de índices: nombre -> (bandas requeridas, función sobre dict de bandas).
+# Agregar un índice es agregar una entrada; no implica otra lectura del stack.
+INDICES = {
+    "ndvi": (("B8", "B4"), lambda b: _normalized_difference(b["B8"], b["B4"])),
+    "ndbi": (("B11", "B8"), lambda b: _normalized_difference(b["B11"], b["B8"])),
+    "ndwi": (("B3", "B8"), lambda b: _normalized_difference(b["B3"], b["B8"])),
+    "bsi": (
+        ("B11", "B4", "B8", "B2"),
+        lambda b: _normalized_difference(b["B11"] + b["B4"], b["B8"] + b["B2"]),
+    ),
+}
+
+
+def band_map(src):
+    """{nombre de banda: índice 1-based} desde las descripciones del archivo o el orden por defecto."""
+    names = [d for d in src.descriptions if d] if src.descriptions else []
+    if len(names) == src.count:
+        return {name: i + 1 for i, name in enumerate(names)}
+    return {name: i + 1 for i, name in enumerate(DEFAULT_BAND_ORDER[: src.count])}
+
+
+def compute_indices(bands, names):
+    """Calcula los índices `names` sobre un dict {banda: arreglo float32 con NaN}."""
+    return {name: INDICES[name][1](bands) for name in names}
+
+
+def _process_window(args):
+    raw_path, window, band_idx, names = args
+    with rasterio.open(raw_path) as src:
+        data = src.read(list(band_idx.values()), window=window, masked=True)
+    data = data.astype("float32").filled(np.nan)
+    bands = dict(zip(band_idx.keys(), data))
+    return window, compute_indices(bands, names)
+
+
+def process_scene(raw_path, out_paths, pool=None, window_size=WINDOW_SIZE):
+    """
+    Calcula todos los índices de `out_paths` ({índice: ruta}) leyendo el stack una vez.
+
+    Con `pool` (ProcessPoolExecutor) las ventanas se procesan en paralelo, con
+    a lo sumo dos por proceso en curso; la escritura se hace en este proceso.
+    """
+    names = list(out_paths)
+    with rasterio.open(raw_path) as src:
+        available = band_map(src)
+        needed = {b for n in names for b in INDICES[n][0]}
+        missing = sorted(b for b in needed if b not in available)
+        if missing:
+            raise ValueError(f"{Path(raw_path).name}: faltan bandas {missing}")
+        # En el orden del archivo, para leerlas en una sola pasada
+        needed = sorted(needed, key=list(available).index)
+        band_idx = {b: available[b] for b in needed}
+        profile = dict(OUTPUT_PROFILE, width=src.width, height=src.height, crs=src.crs, transform=src.transform)
+        windows = list(iter_tiles(src.width, src.height, window_size))
+
+    jobs = [(str(raw_path), w, band_idx, names) for w in windows]
+    results = bounded_map(pool, _process_window, jobs)
+
+    dsts = {}
+    try:
+        for name, path in out_paths.items():
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            dsts[name] = rasterio.open(path, "w", **profile)
+        for window, arrays in results:
+            for name, arr in arrays.items():
+                dsts[name].write(arr, 1, window=window)
+    finally:
+        for dst in dsts.values():
+            dst.close()
+
+    for path in out_paths.values():
+        write_stats_sidecar(path)
+    return out_paths
+
+
+def process_years(years, raw_dir, out_dir, names=tuple(INDICES), workers=None):
+    """Procesa varios años compartiendo un único pool de procesos."""
+    raw_dir, out_dir = Path(raw_dir), Path(out_dir)
+    workers = workers or os.cpu_count() or 1
+    outputs = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for year in years:
+            raw_path = raw_dir / RAW_TEMPLATE.format(year=year)
+            out_paths = {n: out_dir / OUTPUT_TEMPLATE.format(index=n, year=year) for n in names}
+            logger.info(f"{raw_path.name}: calculando {', '.join(names)}")
+            outputs[year] = process_scene(raw_path, out_paths, pool=pool)
+    return outputs
+
+
+@click.command()
+@click.option("--raw", "raw_dir", default="data/raw", help="Directorio con los stacks Sentinel-2")
+@click.option("--out", "out_dir", default="data/processed", help="Directorio de salida")
+@click.option("--years", default="2017,2019,2021,2024", help="Años separados por coma")
+@click.option("--indices", "names", default=",".join(INDICES), help="Índices separados por coma")
+@click.option("--workers", default=None, type=int, help="Procesos (por defecto, núcleos disponibles)")
+def main(raw_dir, out_dir, years, names, workers):
+    """Calcula los índices espectrales para todos los años."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    names = [n.strip().lower() for n in names.split(",") if n.strip()]
+    unknown = [n for n in names if n not in INDICES]
+    if unknown:
+        raise click.BadParameter(f"Índices desconocidos: {unknown}")
+    years = [int(y) for y in years.split(",") if y.strip()]
+    process_years(years, raw_dir, out_dir, names, workers)
+    logger.info("Índices calculados")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+Pipeline incremental de productos como grafo de dependencias.
+
+    escenas crudas -> índices por año -> deltas / cambio binario -> métricas por zona -> CSV/GPKG
+
+Cada tarea declara sus archivos de entrada y salida. Al terminar se registra
+en un manifiesto el hash de contenido (SHA1) de sus entradas y salidas, y al
+volver a correr solo se reconstruyen las tareas cuyas entradas o parámetros
+cambiaron o cuyas salidas faltan. Las ramas independientes (p. ej. los
+índices de cada año) se ejecutan en paralelo.
+
+Agregar un año (p. ej. 2026) solo calcula sus índices, los deltas y máscaras
+que lo usan y las métricas por zona que dependen de ellos:
+
+    python scripts/pipeline.py --years 2017,2019,2021,2024,2026
+    python scripts/pipeline.py --dry-run
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import click
+import geopandas as gpd
+
+from change_detection import write_change_mask, write_delta
+from disk_cache import file_fingerprint, make_key
+from exports import parquet_available
+from indices import INDICES, OUTPUT_TEMPLATE, RAW_TEMPLATE, process_scene
+from raster_stats import write_stats_sidecar
+from zonal import CHANGE_THRESHOLDS, label_raster, zonal_stats
+from zone_store import META_FILE as ZONE_STORE_META
+from zone_store import STORE_FILES, build_zone_store
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "pipeline_manifest.json"
+# Columnas de cambios_por_zona.gpkg que calcula el pipeline; el resto son atributos de las zonas
+ZONE_METRIC_COLUMNS = [col for rules in CHANGE_THRESHOLDS.values() for col, *_ in rules]
+
+
+class Task:
+    """Nodo del grafo: `action()` produce `outputs` a partir de `inputs`."""
+
+    def __init__(self, name, inputs, outputs, action, params=None):
+        self.name = name
+        self.inputs = [Path(p) for p in inputs]
+        self.outputs = [Path(p) for p in outputs]
+        self.action = action
+        self.params = params or {}
+
+
+class Manifest:
+    """Hashes registrados por tarea, con caché de hashes por (tamaño, mtime)."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            data = {}
+        self.tasks = data.get("tasks", {})
+        self.hashes = data.get("hashes", {})
+
+    def content_hash(self, path):
+        fp = file_fingerprint(path)
+        key = str(Path(path).resolve())
+        with self._lock:
+            cached = self.hashes.get(key)
+        if cached and (cached["size"], cached["mtime_ns"]) == (fp["size"], fp["mtime_ns"]):
+            return cached["sha1"]
+        sha1 = file_fingerprint(path, checksum=True)["sha1"]
+        with self._lock:
+            self.hashes[key] = {"size": fp["size"], "mtime_ns": fp["mtime_ns"], "sha1": sha1}
+        return sha1
+
+    def state(self, task):
+        return {
+            "params": make_key(task.params),
+            "inputs": {str(p): self.content_hash(p) for p in task.inputs},
+        }
+
+    def stale_reason(self, task):
+        """Motivo por el que la tarea debe correr, o None si está al día."""
+        missing = [p.name for p in task.inputs if not p.exists()]
+        if missing:
+            raise FileNotFoundError(f"{task.name}: faltan entradas {missing}")
+        if any(not p.exists() for p in task.outputs):
+            return "faltan salidas"
+        record = self.tasks.get(task.name)
+        if record is None:
+            return "sin registro"
+        current = self.state(task)
+        if record["params"] != current["params"]:
+            return "cambiaron los parámetros"
+        changed = [Path(p).name for p, h in current["inputs"].items() if record["inputs"].get(p) != h]
+        if changed:
+            return f"cambiaron {', '.join(changed)}"
+        if any(record["outputs"].get(str(p)) != self.content_hash(p) for p in task.outputs):
+            return "salidas modificadas"
+        return None
+
+    def record(self, task):
+        state = self.state(task)
+        state["outputs"] = {str(p): self.content_hash(p) for p in task.outputs}
+        with self._lock:
+            self.tasks[task.name] = state
+            self._save()
+
+    def _save(self):
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"tasks": self.tasks, "hashes": self.hashes}, indent=1))
+        os.replace(tmp, self.path)
+
+
+def _dependencies(tasks):
+    producer = {p.resolve(): t.name for t in tasks for p in t.outputs}
+    return {t.name: {producer[p.resolve()] for p in t.inputs if p.resolve() in producer} for t in tasks}
+
+
+def run(tasks, manifest, workers=4, force=(), dry_run=False):
+    """
+    Ejecuta las tareas desactualizadas respetando dependencias, en paralelo.
+
+    Devuelve {tarea: "ok" | "al día" | "error" | "omitida"}.
+    """
+    by_name = {t.name: t for t in tasks}
+    deps = _dependencies(tasks)
+    status = {}
+    rebuilt = set()
+
+    def execute(task):
+        if dry_run and deps[task.name] & rebuilt:
+            # Sus entradas aún no existen o van a cambiar
+            logger.info(f"[dry-run] {task.name}: dependencia pendiente")
+            return "pendiente", "dependencia pendiente"
+        reason = "forzada" if task.name in force else manifest.stale_reason(task)
+        # Si una dependencia se reconstruye, sus hashes cambian y esta tarea queda desactualizada
+        if reason is None and not (deps[task.name] & rebuilt):
+            return "al día", None
+        reason = reason or "dependencia reconstruida"
+        if dry_run:
+            logger.info(f"[dry-run] {task.name}: {reason}")
+            return "pendiente", reason
+        logger.info(f"{task.name}: {reason}")
+        t0 = time.perf_counter()
+        for p in task.outputs:
+            p.parent.mkdir(parents=True, exist_ok=True)
+        task.action()
+        manifest.record(task)
+        logger.info(f"{task.name}: listo en {time.perf_counter() - t0:.1f}s")
+        return "ok", reason
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while len(status) < len(tasks):
+            progressed = False
+            for name, task in by_name.items():
+                if name in status or name in running.values():
+                    continue
+                if any(status.get(d) in ("error", "omitida") for d in deps[name]):
+                    status[name] = "omitida"
+                    progressed = True
+                    logger.warning(f"{name}: omitida por error en una dependencia")
+                elif all(d in status for d in deps[name]):
+                    running[pool.submit(execute, task)] = name
+            if not running:
+                if progressed:
+                    continue
+                raise RuntimeError("El grafo de tareas tiene un ciclo")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                try:
+                    status[name], _ = fut.result()
+                except Exception as e:
+                    logger.error(f"{name}: {e}")
+                    status[name] = "error"
+                if status[name] in ("ok", "pendiente"):
+                    rebuilt.add(name)
+    return status
+
+
+# -----------------------------
+# Grafo de productos de Pudahuel
+# -----------------------------
+def build_tasks(years, raw_dir, processed_dir, outputs_dir, zones_path, cache_dir, names=tuple(INDICES), pool=None):
+    """
+    Tareas para `years`: índices por año, deltas y cambio binario de cada año
+    respecto del primero, y métricas por zona del período completo.
+    """
+    raw_dir, processed_dir, outputs_dir = Path(raw_dir), Path(processed_dir), Path(outputs_dir)
+    years = sorted(years)
+    tasks = []
+
+    def product(index, year):
+        return processed_dir / OUTPUT_TEMPLATE.format(index=index, year=year)
+
+    for y in years:
+        out_paths = {n: product(n, y) for n in names}
+        tasks.append(
+            Task(
+                f"indices_{y}",
+                [raw_dir / RAW_TEMPLATE.format(year=y)],
+                out_paths.values(),
+                lambda y=y, out_paths=out_paths: process_scene(raw_dir / RAW_TEMPLATE.format(year=y), out_paths, pool),
+                {"indices": list(names)},
+            )
+        )
+
+    def delta_action(a, b, out):
+        write_delta(a, b, out)
+        write_stats_sidecar(out)
+
+    for y in years[1:]:
+        a, b = years[0], y
+        for index in ("ndvi", "ndbi"):
+            out = processed_dir / f"delta_{index}_{a}_{b}.tif"
+            tasks.append(
+                Task(
+                    f"delta_{index}_{a}_{b}",
+                    [product(index, a), product(index, b)],
+                    [out],
+                    lambda a=a, b=b, index=index, out=out: delta_action(product(index, a), product(index, b), out),
+                )
+            )
+        sources = [product("ndvi", a), product("ndvi", b), product("ndbi", a), product("ndbi", b)]
+        out = processed_dir / f"cambio_urbano_{a}_{b}.tif"
+        tasks.append(
+            Task(
+                f"cambio_urbano_{a}_{b}",
+                sources,
+                [out],
+                lambda sources=sources, out=out: write_change_mask(*sources, out),
+            )
+        )
+
+    a, b = years[0], years[-1]
+    deltas = {
+        "delta_ndvi": processed_dir / f"delta_ndvi_{a}_{b}.tif",
+        "delta_ndbi": processed_dir / f"delta_ndbi_{a}_{b}.tif",
+    }
+    zones_gpkg = processed_dir / "cambios_por_zona.gpkg"
+    zones_csv = outputs_dir / "cambios_por_zona_pudahuel.csv"
+
+    def zone_metrics():
+        labels, ids = label_raster(zones_path, deltas["delta_ndvi"], cache_dir)
+        df = zonal_stats(labels, deltas, ids, CHANGE_THRESHOLDS)
+        cols = ["zone_id", *ZONE_METRIC_COLUMNS]
+        df[cols].to_csv(zones_csv, index=False)
+        # Se conservan todos los atributos de las zonas; solo se reemplazan las métricas
+        zones = gpd.read_file(zones_path)
+        zones = zones.drop(columns=[c for c in ZONE_METRIC_COLUMNS if c in zones.columns])
+        zones.merge(df[cols], on="zone_id", how="left").to_file(zones_gpkg, driver="GPKG")
+
+    tasks.append(
+        Task(
+            f"zonas_{a}_{b}",
+            [zones_path, *deltas.values()],
+            [zones_csv, zones_gpkg],
+            zone_metrics,
+            {"thresholds": CHANGE_THRESHOLDS},
+        )
+    )
+
+    if parquet_available():
+        store_dir = processed_dir / "zone_store"
+        tasks.append(
+            Task(
+                "zonas_almacen",
+                [zones_gpkg],
+                [store_dir / name for name in (*STORE_FILES.values(), ZONE_STORE_META)],
+                lambda: build_zone_store(zones_gpkg, store_dir),
+            )
+        )
+
+    layers = {f"{n}_{y}": product(n, y) for n in names for y in years}
+    zonal_csv = outputs_dir / "zonal_stats.csv"
+
+    def zone_stats():
+        labels, ids = label_raster(zones_path, product(names[0], years[0]), cache_dir)
+        zonal_stats(labels, layers, ids).to_csv(zonal_csv, index=False)
+
+    tasks.append(Task("zonas_estadisticas", [zones_path, *layers.values()], [zonal_csv], zone_stats))
+    return tasks
+
+
+def bootstrap_zones(zones_path, processed_dir):
+    """
+    Crea la capa de zonas (geometría y atributos, sin las métricas que
+    calcula el pipeline) desde `cambios_por_zona.gpkg` si aún no existe, para
+    que la entrada del grafo no sea también una de sus salidas.
+    """
+    zones_path = Path(zones_path)
+    source = Path(processed_dir) / "cambios_por_zona.gpkg"
+    if zones_path.exists() or not source.exists():
+        return
+    gdf = gpd.read_file(source)
+    gdf.drop(columns=[c for c in ZONE_METRIC_COLUMNS if c in gdf.columns]).to_file(zones_path, driver="GPKG")
+    logger.info(f"Geometrías de zonas extraídas a {zones_path}")
+
+
+@click.command()
+@click.option("--years", default="2017,2019,2021,2024", help="Años separados por coma")
+@click.option("--raw", "raw_dir", default="data/raw", help="Directorio con los stacks Sentinel-2")
+@click.option("--processed", "processed_dir", default="data/processed", help="Directorio de productos")
+@click.option("--outputs", "outputs_dir", default="outputs", help="Directorio de tablas")
+@click.option("--zones", "zones_path", default="data/processed/zonas.gpkg", help="Geometrías de zonas")
+@click.option("--cache", "cache_dir", default="data/cache/zonal", help="Caché del raster de etiquetas")
+@click.option("--workers", default=4, type=int, help="Tareas en paralelo")
+@click.option("--force", multiple=True, help="Tareas a reconstruir aunque estén al día")
+@click.option("--dry-run", is_flag=True, help="Solo lista las tareas desactualizadas")
+def main(years, raw_dir, processed_dir, outputs_dir, zones_path, cache_dir, workers, force, dry_run):
+    """Reconstruye solo los productos desactualizados."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    years = [int(y) for y in years.split(",") if y.strip()]
+    bootstrap_zones(zones_path, processed_dir)
+    manifest = Manifest(Path(processed_dir) / MANIFEST_NAME)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tasks = build_tasks(years, raw_dir, processed_dir, outputs_dir, zones_path, cache_dir, pool=pool)
+        status = run(tasks, manifest, workers=workers, force=set(force), dry_run=dry_run)
+
+    summary = {}
+    for s in status.values():
+        summary[s] = summary.get(s, 0) + 1
+    logger.info(f"Resumen: {summary}")
+    if "error" in summary:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Consultas puntuales (serie temporal de un píxel) con datasets abiertos.
+
+Los rasters se abren una vez y quedan en un pool; cada consulta lee una
+ventana de 1x1 píxel por año e índice. Un archivo reemplazado (p. ej. por el
+pipeline) se detecta por tamaño/mtime y se vuelve a abrir. Las consultas
+recientes se guardan en un LRU por píxel, así un clic en el mismo píxel no
+vuelve a leer nada.
+"""
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from pyproj import Transformer
+from rasterio.windows import Window
+
+
+def _signature(path):
+    st = Path(path).stat()
+    return st.st_size, st.st_mtime_ns
+
+
+class DatasetPool:
+    """Handles de rasterio abiertos por ruta, con un lock por dataset (no son thread-safe)."""
+
+    def __init__(self):
+        self._handles = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, sig=None):
+        """(dataset, lock) de `path`, reabriendo si el archivo cambió."""
+        key = str(path)
+        sig = sig or _signature(path)
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is not None and entry[2] != sig:
+                with entry[1]:
+                    entry[0].close()
+                entry = None
+            if entry is None:
+                entry = (rasterio.open(path), threading.Lock(), sig)
+                self._handles[key] = entry
+        return entry[0], entry[1]
+
+    def close(self):
+        with self._lock:
+            for src, lock, _ in self._handles.values():
+                with lock:
+                    src.close()
+            self._handles.clear()
+
+
+class PointQuery:
+    """
+    Valores de todos los productos en un punto (lon/lat WGS84).
+
+    `products` es {índice: {año: ruta}}; se asume que todos comparten grilla,
+    así el píxel se calcula una vez y sirve de clave del caché.
+    """
+
+    def __init__(self, products, max_entries=256):
+        self.products = {i: {y: Path(p) for y, p in d.items()} for i, d in products.items()}
+        self.pool = DatasetPool()
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._transformers = {}
+
+    def _paths(self):
+        for index, by_year in self.products.items():
+            for year, path in sorted(by_year.items()):
+                try:
+                    yield index, year, path, _signature(path)
+                except OSError:
+                    continue
+
+    def _pixel(self, src, lon, lat):
+        crs = src.crs.to_string() if src.crs else "EPSG:4326"
+        tr = self._transformers.get(crs)
+        if tr is None:
+            tr = self._transformers[crs] = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+        x, y = tr.transform(lon, lat)
+        row, col = src.index(x, y)
+        return int(row), int(col)
+
+    def query(self, lon, lat):
+        """
+        {índice: {año: valor}} en el punto; NaN si no hay dato o cae fuera.
+
+        El píxel se calcula con el primer raster disponible.
+        """
+        paths = list(self._paths())
+        if not paths:
+            return {}
+        ref, ref_lock = self.pool.get(paths[0][2], paths[0][3])
+        with ref_lock:
+            row, col = self._pixel(ref, lon, lat)
+        # La firma de los archivos entra en la clave: un raster regenerado invalida el caché
+        key = (row, col, tuple(sig for *_, sig in paths))
+        with self._cache_lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+                return hit
+
+        out = {}
+        for index, year, path, sig in paths:
+            src, lock = self.pool.get(path, sig)
+            value = np.nan
+            if 0 <= row < src.height and 0 <= col < src.width:
+                with lock:
+                    a = src.read(1, window=Window(col, row, 1, 1), masked=True)
+                if not a.mask.all():
+                    value = float(a.filled(np.nan)[0, 0])
+            out.setdefault(index, {})[year] = value
+
+        with self._cache_lock:
+            self._cache[key] = out
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return out
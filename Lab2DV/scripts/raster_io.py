@@ -0,0 +1,150 @@
+"""Lecturas raster: decimación vía overviews de GDAL y recorrido por ventanas."""
+import hashlib
+import math
+import os
+import tempfile
+from collections import deque
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+
+from disk_cache import file_lock
+
+OVERVIEW_FACTORS = [2, 4, 8, 16, 32]
+# Locks de construcción de overviews, uno por ruta de raster (fuera de los directorios de datos)
+LOCK_DIR = Path(os.getenv("GEOLAB_LOCK_DIR", str(Path(tempfile.gettempdir()) / "geolab-locks")))
+
+
+def _overview_lock(raster_path):
+    LOCK_DIR.mkdir(parents=True, exist_ok=True)
+    key = hashlib.sha1(str(Path(raster_path).resolve()).encode("utf-8")).hexdigest()
+    return file_lock(LOCK_DIR / f"{key}.lock")
+
+
+def ensure_overviews(raster_path, resampling=Resampling.average, min_size=256, lock=True):
+    """
+    Construye overviews internas si el archivo no las tiene.
+
+    Devuelve True si el archivo quedó con overviews. Si no se puede escribir
+    (p. ej. volumen de solo lectura) devuelve False y las lecturas siguen
+    funcionando con decimación sobre la resolución nativa.
+
+    La construcción va bajo un lock entre procesos por ruta (en `LOCK_DIR`):
+    si otro proceso o hilo ya las está construyendo, se espera y se
+    reutilizan. Quien acaba de escribir el archivo (p. ej. en un temporal que
+    nadie más ve) pasa `lock=False`.
+    """
+    try:
+        with rasterio.open(raster_path) as src:
+            if src.overviews(1):
+                return True
+        with _overview_lock(raster_path) if lock else nullcontext():
+            # Otro proceso pudo construirlas mientras se esperaba el lock
+            with rasterio.open(raster_path) as src:
+                if src.overviews(1):
+                    return True
+                factors = [f for f in OVERVIEW_FACTORS if max(src.width, src.height) / f >= min_size]
+            if not factors:
+                return False
+            with rasterio.open(raster_path, "r+") as dst:
+                dst.build_overviews(factors, resampling)
+                dst.update_tags(ns="rio_overview", resampling=resampling.name)
+        return True
+    except (rasterio.errors.RasterioIOError, OSError):
+        return False
+
+
+def shape_for_zoom(src, zoom, max_size=None):
+    """
+    Tamaño (alto, ancho) con que se ve el raster en un mapa web al nivel `zoom`.
+
+    Nunca supera la resolución nativa; `max_size` acota además el lado mayor
+    (p. ej. al ancho de la pantalla).
+    """
+    if src.crs is None:
+        west, south, east, north = src.bounds.left, src.bounds.bottom, src.bounds.right, src.bounds.top
+    else:
+        west, south, east, north = transform_bounds(src.crs, "EPSG:4326", *src.bounds, densify_pts=21)
+
+    world_px = 256 * 2 ** zoom
+
+    def merc_y(lat):
+        lat = math.radians(max(min(lat, 85.0511), -85.0511))
+        return math.log(math.tan(math.pi / 4 + lat / 2)) / (2 * math.pi)
+
+    width = (east - west) / 360.0 * world_px
+    height = abs(merc_y(north) - merc_y(south)) * world_px
+
+    scale = max(width / src.width, height / src.height)
+    if max_size is not None:
+        scale = min(scale, max_size / max(src.width, src.height))
+    scale = min(scale, 1.0)
+
+    return max(1, int(round(src.height * scale))), max(1, int(round(src.width * scale)))
+
+
+def read_decimated(src, out_shape=None, band=1, resampling=Resampling.average):
+    """
+    Lee una banda como float32 con NaN en nodata, decimada a `out_shape`.
+
+    Con `out_shape` menor que el raster, GDAL lee desde la overview más
+    cercana en lugar de la resolución nativa.
+    """
+    if out_shape is None or tuple(out_shape) == (src.height, src.width):
+        arr = src.read(band, masked=True)
+    else:
+        arr = src.read(band, out_shape=tuple(out_shape), resampling=resampling, masked=True)
+    return arr.astype("float32").filled(np.nan)
+
+
+def iter_windows(src, max_pixels=2 ** 20):
+    """
+    Recorre el raster en ventanas de filas completas de ~`max_pixels` píxeles.
+
+    La altura de cada ventana es múltiplo del alto de bloque del archivo, de
+    modo que cada lectura decodifica bloques completos una sola vez.
+    """
+    block_h = src.block_shapes[0][0] if src.block_shapes else 1
+    rows = max(block_h, (max_pixels // max(src.width, 1)) // block_h * block_h)
+    for row_off in range(0, src.height, rows):
+        yield Window(0, row_off, src.width, min(rows, src.height - row_off))
+
+
+def iter_tiles(width, height, size=512):
+    """Ventanas cuadradas de `size` px alineadas a la grilla (múltiplo del teselado de salida)."""
+    for row_off in range(0, height, size):
+        for col_off in range(0, width, size):
+            yield Window(col_off, row_off, min(size, width - col_off), min(size, height - row_off))
+
+
+def bounded_map(pool, fn, jobs, max_in_flight=None):
+    """
+    Como `pool.map(fn, jobs)`, pero con a lo sumo `max_in_flight` trabajos enviados sin consumir.
+
+    `pool.map` envía todos los trabajos de inmediato y sus resultados se
+    acumulan en memoria si la escritura va más lenta; aquí se envía uno nuevo
+    por cada resultado entregado (por defecto, 2 por proceso del pool). Los
+    resultados salen en el orden de `jobs`. Sin `pool` se procesa en serie.
+    """
+    if pool is None:
+        yield from map(fn, jobs)
+        return
+    if max_in_flight is None:
+        max_in_flight = 2 * (getattr(pool, "_max_workers", None) or os.cpu_count() or 1)
+    jobs = iter(jobs)
+    pending = deque()
+    try:
+        for job in jobs:
+            pending.append(pool.submit(fn, job))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
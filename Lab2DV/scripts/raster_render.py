@@ -0,0 +1,129 @@
+"""
+Render de rasters de índices (NDVI/NDBI/deltas) a RGBA para los mapas.
+
+Los colores salen de una tabla (LUT) de 256x4 por paleta: el raster se
+cuantiza una sola vez a índices uint8 (0 = sin dato, transparente) y se
+indexa la LUT directamente sobre un buffer RGBA preasignado, sin arreglos
+float intermedios por canal.
+"""
+import struct
+import zlib
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_ALPHA = 0.85
+
+# Paletas como puntos de control (posición 0-1, (r, g, b) 0-1)
+RAMPS = {
+    # Rojo -> amarillo -> verde (el colormap original del dashboard)
+    "ryg": [(0.0, (1.0, 0.0, 0.3)), (0.5, (1.0, 1.0, 0.3)), (1.0, (0.0, 1.0, 0.3))],
+    # Secuencial para NDBI (más construido = más oscuro)
+    "ylorrd": [
+        (0.0, (1.0, 1.0, 0.8)),
+        (0.35, (0.996, 0.698, 0.298)),
+        (0.7, (0.941, 0.231, 0.125)),
+        (1.0, (0.502, 0.0, 0.149)),
+    ],
+    # Divergentes centradas en 0 para los deltas
+    "rdylgn": [
+        (0.0, (0.647, 0.0, 0.149)),
+        (0.25, (0.957, 0.427, 0.263)),
+        (0.5, (1.0, 1.0, 0.749)),
+        (0.75, (0.455, 0.769, 0.463)),
+        (1.0, (0.0, 0.408, 0.216)),
+    ],
+    "bu_rd": [
+        (0.0, (0.129, 0.4, 0.675)),
+        (0.25, (0.573, 0.773, 0.871)),
+        (0.5, (0.969, 0.969, 0.969)),
+        (0.75, (0.957, 0.647, 0.51)),
+        (1.0, (0.698, 0.094, 0.169)),
+    ],
+}
+DIVERGING_RAMPS = {"rdylgn", "bu_rd"}
+
+# Paleta por producto (prefijo del nombre de archivo)
+LAYER_RAMPS = [
+    ("cambio_urbano", "ylorrd"),
+    ("delta_ndvi", "rdylgn"),
+    ("delta_ndbi", "bu_rd"),
+    ("ndbi", "ylorrd"),
+    ("ndvi", "ryg"),
+]
+
+
+def ramp_for(raster_path):
+    """Paleta por defecto según el nombre del raster."""
+    name = Path(raster_path).name
+    for prefix, ramp in LAYER_RAMPS:
+        if name.startswith(prefix):
+            return ramp
+    return "ryg"
+
+
+def is_diverging(ramp):
+    return ramp in DIVERGING_RAMPS
+
+
+def symmetric_stretch(vmin, vmax):
+    """Stretch centrado en 0 para paletas divergentes."""
+    m = max(abs(vmin), abs(vmax)) or 1e-9
+    return -m, m
+
+
+@lru_cache(maxsize=None)
+def build_lut(ramp="ryg", alpha=DEFAULT_ALPHA):
+    """LUT 256x4 uint8: fila 0 transparente (sin dato), filas 1-255 la paleta."""
+    stops = RAMPS[ramp]
+    pos = np.array([p for p, _ in stops])
+    rgb = np.array([c for _, c in stops])
+    x = np.linspace(0.0, 1.0, 255)
+
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    for ch in range(3):
+        lut[1:, ch] = np.round(np.interp(x, pos, rgb[:, ch]) * 255)
+    lut[1:, 3] = round(alpha * 255)
+    lut.setflags(write=False)
+    return lut
+
+
+def quantize(arr, vmin, vmax):
+    """Índices uint8 de la LUT: 1-255 para valores en [vmin, vmax], 0 para NaN."""
+    scaled = np.subtract(arr, vmin, dtype=np.float32)
+    scaled *= np.float32(254.0 / (vmax - vmin + 1e-9))
+    np.clip(scaled, 0, 254, out=scaled)
+    scaled += np.float32(1.5)  # 1-255, con redondeo al truncar
+    np.nan_to_num(scaled, copy=False, nan=0.0)
+    return scaled.astype(np.uint8)
+
+
+def colorize(arr, vmin, vmax, ramp="ryg", alpha=DEFAULT_ALPHA, out=None):
+    """Devuelve RGBA uint8 (alto, ancho, 4) indexando la LUT de `ramp`."""
+    idx = quantize(arr, vmin, vmax)
+    if out is None:
+        out = np.empty(idx.shape + (4,), dtype=np.uint8)
+    # mode="clip" evita que np.take use un buffer intermedio del tamaño de la salida
+    np.take(build_lut(ramp, alpha), idx, axis=0, out=out, mode="clip")
+    return out
+
+
+def encode_png(rgba):
+    """Codifica un arreglo RGBA uint8 (alto, ancho, 4) como PNG sin dependencias extra."""
+    h, w, _ = rgba.shape
+    # Cada fila PNG parte con el byte de filtro (0 = sin filtro)
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = np.ascontiguousarray(rgba, dtype=np.uint8).reshape(h, w * 4)
+
+    def chunk(tag, data):
+        body = tag + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + chunk(b"IEND", b"")
+    )
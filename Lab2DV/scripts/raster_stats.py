@@ -0,0 +1,170 @@
+"""
+Estadísticas de rasters en una sola pasada por ventanas.
+
+Cada ventana aporta count/media/M2/min/max que se combinan con la fórmula
+de fusión en paralelo de Chan et al. (variante por bloques de Welford), así
+la memoria queda acotada al tamaño de ventana y no al del raster.
+
+Las estadísticas, el histograma y algunos percentiles se guardan en el
+sidecar `<raster>.stats.json` al generar cada producto, de modo que el
+dashboard no necesita leer los rasters al arrancar:
+
+    python scripts/raster_stats.py --input data/processed
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import click
+import numpy as np
+import rasterio
+
+from raster_io import ensure_overviews, iter_windows
+from raster_stretch import DEFAULT_BINS, RasterHistogram, index_range, read_sidecar, write_sidecar
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_PERCENTILES = (2, 5, 25, 50, 75, 95, 98)
+
+
+class RunningStats:
+    """Acumulador de count, media, varianza, mínimo y máximo."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """Agrega un bloque de valores (se ignoran NaN/inf)."""
+        v = np.asarray(values, dtype=np.float64).ravel()
+        v = v[np.isfinite(v)]
+        if v.size == 0:
+            return
+        mean = float(v.mean())
+        d = v - mean
+        self._merge(v.size, mean, float(np.dot(d, d)), float(v.min()), float(v.max()))
+
+    def merge(self, other):
+        if other.count:
+            self._merge(other.count, other.mean, other.m2, other.min, other.max)
+
+    def _merge(self, n_b, mean_b, m2_b, min_b, max_b):
+        n_a = self.count
+        n = n_a + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * n_a * n_b / n
+        self.count = n
+        self.min = min(self.min, min_b)
+        self.max = max(self.max, max_b)
+
+    @property
+    def variance(self):
+        """Varianza poblacional (ddof=0, como `np.nanstd`)."""
+        return self.m2 / self.count if self.count else np.nan
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.variance))
+
+    def to_dict(self):
+        empty = self.count == 0
+        return {
+            "count": self.count,
+            "mean": np.nan if empty else self.mean,
+            "std": self.std,
+            "min": np.nan if empty else self.min,
+            "max": np.nan if empty else self.max,
+        }
+
+
+def raster_stats(raster_path, band=1):
+    """Estadísticas de una banda recorriendo el raster por ventanas."""
+    stats = RunningStats()
+    with rasterio.open(raster_path) as src:
+        for window in iter_windows(src):
+            a = src.read(band, window=window, masked=True)
+            stats.update(a.compressed())
+    return stats
+
+
+def scan_raster(raster_path, value_range=None, bins=DEFAULT_BINS, band=1):
+    """Estadísticas e histograma en la misma pasada por ventanas."""
+    lo, hi = value_range or index_range(raster_path)
+    stats = RunningStats()
+    hist = RasterHistogram(lo, hi, bins)
+    with rasterio.open(raster_path) as src:
+        for window in iter_windows(src):
+            v = src.read(band, window=window, masked=True).compressed()
+            stats.update(v)
+            hist.update(v)
+    return stats, hist
+
+
+def sidecar_payload(stats, hist):
+    percentiles = {}
+    if hist.total:
+        percentiles = {str(p): hist.percentile(p) for p in SIDECAR_PERCENTILES}
+    return {"stats": stats.to_dict(), "histogram": hist.to_dict(), "percentiles": percentiles}
+
+
+def write_stats_sidecar(raster_path, build_overviews=True):
+    """
+    Genera el sidecar de un producto recién escrito.
+
+    Las overviews se construyen antes, porque modifican el archivo y dejarían
+    el sidecar desactualizado si el dashboard las crea después.
+    """
+    if build_overviews:
+        ensure_overviews(raster_path)
+    stats, hist = scan_raster(raster_path)
+    data = sidecar_payload(stats, hist)
+    write_sidecar(raster_path, data)
+    return data
+
+
+def load_stats(raster_path):
+    """Estadísticas desde el sidecar; si falta o está desactualizado, se calculan y guardan."""
+    data = read_sidecar(raster_path)
+    if data and "stats" in data:
+        return data["stats"]
+    stats, hist = scan_raster(raster_path)
+    write_sidecar(raster_path, sidecar_payload(stats, hist))
+    return stats.to_dict()
+
+
+def year_stats(index_dict, max_workers=4):
+    """
+    Estadísticas por año de un dict {año: ruta}, en paralelo.
+
+    Se leen los sidecars cuando están vigentes; si hay que calcular, se usan
+    hilos porque rasterio libera el GIL al leer/decodificar bloques.
+    """
+    items = sorted(index_dict.items())
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        results = list(pool.map(lambda item: load_stats(item[1]), items))
+
+    rows = []
+    for (y, _), d in zip(items, results):
+        rows.append({"Año": y, "Media": d["mean"], "Std": d["std"], "Min": d["min"], "Max": d["max"]})
+    return rows
+
+
+@click.command()
+@click.option("--input", "input_dir", default="data/processed", help="Directorio con los productos .tif")
+@click.option("--pattern", default="*.tif", help="Patrón de archivos")
+def main(input_dir, pattern):
+    """Genera los sidecars de estadísticas para los productos raster."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    for path in sorted(Path(input_dir).glob(pattern)):
+        data = write_stats_sidecar(path)
+        logger.info(f"{path.name}: media={data['stats']['mean']:.4f} n={data['stats']['count']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Stretch por percentiles a partir de un histograma de bins fijos.
+
+El histograma se construye en una pasada por ventanas (memoria constante) y
+se guarda en un sidecar JSON junto al raster. Con él, cualquier percentil se
+obtiene en O(bins) con un error máximo de un ancho de bin, sin ordenar el
+arreglo completo como hace `np.nanpercentile`.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import rasterio
+
+from raster_io import iter_windows
+from raster_render import is_diverging, ramp_for, symmetric_stretch
+
+DEFAULT_BINS = 4096
+SIDECAR_SUFFIX = ".stats.json"
+
+# Dominio de los índices normalizados y de sus diferencias
+INDEX_RANGE = (-1.0, 1.0)
+DELTA_RANGE = (-2.0, 2.0)
+# Máscaras binarias (0/1): se muestran con stretch fijo
+MASK_PREFIXES = ("cambio_urbano",)
+MASK_RANGE = (0.0, 1.0)
+
+
+def is_mask(raster_path):
+    return Path(raster_path).name.startswith(MASK_PREFIXES)
+
+
+def index_range(raster_path):
+    """Dominio esperado según el producto: deltas en [-2, 2], máscaras en [0, 1], índices en [-1, 1]."""
+    name = Path(raster_path).name
+    if name.startswith("delta_"):
+        return DELTA_RANGE
+    return MASK_RANGE if is_mask(raster_path) else INDEX_RANGE
+
+
+class RasterHistogram:
+    """Histograma de bins fijos en [lo, hi] con contadores de desborde y min/max reales."""
+
+    def __init__(self, lo, hi, bins=DEFAULT_BINS, counts=None, under=0, over=0, vmin=None, vmax=None):
+        if not hi > lo:
+            raise ValueError(f"Rango de histograma inválido: [{lo}, {hi}]")
+        self.lo = float(lo)
+        self.hi = float(hi)
+        self.bins = int(bins)
+        self.counts = np.zeros(self.bins, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        self.under = int(under)
+        self.over = int(over)
+        self.min = np.inf if vmin is None else float(vmin)
+        self.max = -np.inf if vmax is None else float(vmax)
+
+    @property
+    def bin_width(self):
+        return (self.hi - self.lo) / self.bins
+
+    @property
+    def error_bound(self):
+        """Error máximo (en unidades del raster) de los percentiles dentro de [lo, hi]."""
+        return self.bin_width
+
+    @property
+    def total(self):
+        return int(self.counts.sum()) + self.under + self.over
+
+    def update(self, values):
+        """Agrega valores (se ignoran NaN/inf) al histograma."""
+        v = np.asarray(values, dtype="float32").ravel()
+        v = v[np.isfinite(v)]
+        if v.size == 0:
+            return
+        self.min = min(self.min, float(v.min()))
+        self.max = max(self.max, float(v.max()))
+        below = v < self.lo
+        above = v > self.hi
+        self.under += int(below.sum())
+        self.over += int(above.sum())
+        v = v[~(below | above)]
+        idx = ((v - self.lo) * (self.bins / (self.hi - self.lo))).astype(np.int64)
+        np.minimum(idx, self.bins - 1, out=idx)
+        self.counts += np.bincount(idx, minlength=self.bins)
+
+    def percentile(self, p):
+        """Percentil aproximado (0-100), interpolando dentro del bin y acotado al min/max de los datos."""
+        total = self.total
+        if total == 0:
+            raise ValueError("Histograma vacío")
+        target = total * p / 100.0
+        if target <= self.under:
+            value = self.lo
+        else:
+            cum = np.cumsum(self.counts) + self.under
+            i = int(np.searchsorted(cum, target, side="left"))
+            if i >= self.bins:
+                value = self.hi
+            else:
+                prev = cum[i - 1] if i > 0 else self.under
+                frac = (target - prev) / self.counts[i] if self.counts[i] else 0.0
+                value = self.lo + (i + frac) * self.bin_width
+        # Los bordes de bin (o lo/hi con desbordes) pueden quedar fuera de los datos
+        return float(min(max(value, self.min), self.max))
+
+    def merge(self, other):
+        """Suma otro histograma con los mismos bins (p. ej. otro año del mismo índice)."""
+        if (other.lo, other.hi, other.bins) != (self.lo, self.hi, self.bins):
+            raise ValueError("Los histogramas deben compartir rango y número de bins")
+        self.counts = self.counts + other.counts
+        self.under += other.under
+        self.over += other.over
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def stretch(self, p_low=2, p_high=98):
+        return self.percentile(p_low), self.percentile(p_high)
+
+    def to_dict(self):
+        return {
+            "lo": self.lo,
+            "hi": self.hi,
+            "bins": self.bins,
+            "under": self.under,
+            "over": self.over,
+            "min": self.min if np.isfinite(self.min) else None,
+            "max": self.max if np.isfinite(self.max) else None,
+            "counts": self.counts.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["lo"], d["hi"], d["bins"], d["counts"], d.get("under", 0), d.get("over", 0),
+                   d.get("min"), d.get("max"))
+
+
+def _value_range(src):
+    lo, hi = np.inf, -np.inf
+    for window in iter_windows(src):
+        a = src.read(1, window=window, masked=True).astype("float32").filled(np.nan)
+        if np.isfinite(a).any():
+            lo = min(lo, float(np.nanmin(a)))
+            hi = max(hi, float(np.nanmax(a)))
+    if not np.isfinite(lo):
+        raise ValueError(f"Raster vacío o sin datos válidos: {src.name}")
+    return lo, hi if hi > lo else lo + 1e-6
+
+
+def build_histogram(raster_path, value_range=None, bins=DEFAULT_BINS):
+    """
+    Construye el histograma recorriendo el raster por ventanas.
+
+    Con `value_range` conocido (p. ej. INDEX_RANGE) basta una pasada; sin él
+    se hace antes una pasada de min/max.
+    """
+    with rasterio.open(raster_path) as src:
+        lo, hi = value_range if value_range is not None else _value_range(src)
+        hist = RasterHistogram(lo, hi, bins)
+        for window in iter_windows(src):
+            a = src.read(1, window=window, masked=True)
+            hist.update(a.compressed())
+    return hist
+
+
+def sidecar_path(raster_path):
+    p = Path(raster_path)
+    return p.with_name(p.name + SIDECAR_SUFFIX)
+
+
+def source_signature(raster_path):
+    st = Path(raster_path).stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def read_sidecar(raster_path):
+    """Devuelve el contenido del sidecar si existe y corresponde al raster actual."""
+    sc = sidecar_path(raster_path)
+    try:
+        data = json.loads(sc.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if data.get("source") != source_signature(raster_path):
+        return None
+    return data
+
+
+def write_sidecar(raster_path, data):
+    """Escribe el sidecar; en volúmenes de solo lectura se omite sin error."""
+    data = dict(data, source=source_signature(raster_path))
+    try:
+        sidecar_path(raster_path).write_text(json.dumps(data), encoding="utf-8")
+        return True
+    except OSError:
+        return False
+
+
+def load_histogram(raster_path, value_range=None, bins=DEFAULT_BINS):
+    """Lee el histograma del sidecar o lo construye (y guarda) si falta o está desactualizado."""
+    data = read_sidecar(raster_path)
+    # Los sidecars anteriores no guardan min/max y se reconstruyen
+    if data and "min" in data.get("histogram", {}):
+        return RasterHistogram.from_dict(data["histogram"])
+
+    hist = build_histogram(raster_path, value_range=value_range, bins=bins)
+    data = dict(data or {}, histogram=hist.to_dict())
+    write_sidecar(raster_path, data)
+    return hist
+
+
+def histogram_stretch(raster_path, p_low=2, p_high=98, value_range=None):
+    """(vmin, vmax) por percentiles usando el histograma del raster."""
+    hist = load_histogram(raster_path, value_range=value_range)
+    if hist.total == 0:
+        raise ValueError(f"Raster vacío o sin datos válidos: {Path(raster_path).name}")
+    return hist.stretch(p_low, p_high)
+
+
+def layer_stretch(raster_path, ramp=None, p_low=2, p_high=98):
+    """Stretch por defecto de una capa: percentiles 2–98, centrado en 0 si la paleta es divergente."""
+    if is_mask(raster_path):
+        return MASK_RANGE
+    vmin, vmax = histogram_stretch(raster_path, p_low, p_high, value_range=index_range(raster_path))
+    if is_diverging(ramp or ramp_for(raster_path)):
+        vmin, vmax = symmetric_stretch(vmin, vmax)
+    return vmin, vmax
+
+
+def common_stretch(raster_paths, ramp=None, p_low=2, p_high=98):
+    """
+    Stretch compartido por varios rasters (p. ej. los dos años del comparador),
+    calculado sobre la suma de sus histogramas para que los colores sean comparables.
+    """
+    raster_paths = list(raster_paths)
+    merged = None
+    for p in raster_paths:
+        hist = load_histogram(p, value_range=index_range(p))
+        merged = RasterHistogram.from_dict(hist.to_dict()) if merged is None else merged.merge(hist)
+    if merged is None or merged.total == 0:
+        raise ValueError("Rasters vacíos o sin datos válidos")
+    vmin, vmax = merged.stretch(p_low, p_high)
+    if is_diverging(ramp or ramp_for(raster_paths[0])):
+        vmin, vmax = symmetric_stretch(vmin, vmax)
+    return vmin, vmax
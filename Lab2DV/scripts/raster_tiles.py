@@ -0,0 +1,184 @@
+"""
+Servidor local de teselas XYZ (web mercator) para los rasters de índices.
+
+En lugar de incrustar el raster completo como ImageOverlay, el mapa pide
+teselas de 256x256 bajo demanda. Cada tesela se reproyecta con un WarpedVRT
+del tamaño de la tesela, así que solo se lee la porción visible del raster.
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+
+from raster_io import ensure_overviews
+from raster_render import colorize, encode_png, ramp_for
+from raster_stretch import layer_stretch
+
+TILE_SIZE = 256
+WEB_MERCATOR = "EPSG:3857"
+ORIGIN_SHIFT = 2 * math.pi * 6378137 / 2.0  # 20037508.34 m
+
+
+def tile_bounds(z, x, y):
+    """Límites (xmin, ymin, xmax, ymax) en EPSG:3857 de la tesela z/x/y."""
+    size = 2 * ORIGIN_SHIFT / (2 ** z)
+    xmin = -ORIGIN_SHIFT + x * size
+    ymax = ORIGIN_SHIFT - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def layer_id(raster_path, *params):
+    """Identificador estable de capa a partir de la ruta, el mtime y los parámetros de estilo."""
+    p = Path(raster_path)
+    key = ":".join(str(x) for x in (p.resolve(), p.stat().st_mtime_ns) + params)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+class TileRenderer:
+    """Renderiza teselas PNG de capas registradas con un caché LRU acotado."""
+
+    def __init__(self, max_tiles=512):
+        self.max_tiles = max_tiles
+        self._layers = {}
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, raster_path, vmin=None, vmax=None, ramp=None):
+        """Registra un raster y fija su stretch global (no por tesela)."""
+        raster_path = Path(raster_path)
+        # Las teselas de zoom bajo se leen desde las overviews (antes de fijar
+        # el id, porque construirlas cambia el mtime del archivo)
+        ensure_overviews(raster_path)
+
+        with rasterio.open(raster_path) as src:
+            if src.crs is None:
+                raise ValueError(f"El raster no tiene CRS, no se puede teselar: {raster_path.name}")
+        if vmin is None or vmax is None:
+            lo, hi = layer_stretch(raster_path, ramp)
+            vmin = lo if vmin is None else vmin
+            vmax = hi if vmax is None else vmax
+        ramp = ramp or ramp_for(raster_path)
+
+        lid = layer_id(raster_path, float(vmin), float(vmax), ramp)
+        with self._lock:
+            self._layers.setdefault(
+                lid, {"path": raster_path, "vmin": float(vmin), "vmax": float(vmax), "ramp": ramp}
+            )
+        return lid
+
+    def render(self, lid, z, x, y):
+        """Devuelve los bytes PNG de la tesela, usando el caché si está disponible."""
+        key = (lid, z, x, y)
+        with self._lock:
+            layer = self._layers.get(lid)
+            if layer is None:
+                raise KeyError(lid)
+            png = self._tiles.get(key)
+            if png is not None:
+                self._tiles.move_to_end(key)
+                return png
+
+        png = encode_png(self._render_rgba(layer, z, x, y))
+
+        with self._lock:
+            self._tiles[key] = png
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return png
+
+    def _render_rgba(self, layer, z, x, y):
+        dst_transform = from_bounds(*tile_bounds(z, x, y), TILE_SIZE, TILE_SIZE)
+        with rasterio.open(layer["path"]) as src:
+            with WarpedVRT(
+                src,
+                crs=WEB_MERCATOR,
+                transform=dst_transform,
+                width=TILE_SIZE,
+                height=TILE_SIZE,
+                resampling=Resampling.nearest,
+            ) as vrt:
+                arr = vrt.read(1, masked=True).astype("float32").filled(np.nan)
+        return colorize(arr, layer["vmin"], layer["vmax"], ramp=layer["ramp"])
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    # {tipo: (función render(lid, z, x, y), extensión, content-type)}
+    routes = {}
+
+    def do_GET(self):
+        # Ruta esperada: /<tipo>/<capa>/<z>/<x>/<y>.<ext>
+        parts = self.path.split("?")[0].strip("/").split("/")
+        try:
+            if len(parts) != 5 or parts[0] not in self.routes:
+                raise ValueError(self.path)
+            render, ext, content_type = self.routes[parts[0]]
+            if not parts[4].endswith(ext):
+                raise ValueError(self.path)
+            lid = parts[1]
+            z, x, y = int(parts[2]), int(parts[3]), int(parts[4][: -len(ext)])
+            body = render(lid, z, x, y)
+        except (KeyError, ValueError):
+            self.send_error(404)
+            return
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "public, max-age=3600")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TileServer:
+    """
+    Servidor HTTP en un hilo daemon que expone las teselas raster de un
+    TileRenderer (`/tiles/...png`) y fuentes vectoriales MVT (`/mvt/...pbf`).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, public_url=None, max_tiles=512):
+        self.renderer = TileRenderer(max_tiles=max_tiles)
+        self.vector_sources = {}
+        routes = {
+            "tiles": (self.renderer.render, ".png", "image/png"),
+            "mvt": (self._render_vector, ".pbf", "application/x-protobuf"),
+        }
+        handler = type("TileHandler", (_TileHandler,), {"routes": routes})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.public_url = (public_url or f"http://{'localhost' if host in ('0.0.0.0', '') else host}:{self.port}").rstrip("/")
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def url_template(self, raster_path, vmin=None, vmax=None, ramp=None):
+        """Registra el raster y devuelve la plantilla XYZ para Leaflet."""
+        lid = self.renderer.register(raster_path, vmin=vmin, vmax=vmax, ramp=ramp)
+        return f"{self.public_url}/tiles/{lid}/{{z}}/{{x}}/{{y}}.png"
+
+    def add_vector_source(self, name, source):
+        """Registra una fuente con `render(z, x, y) -> bytes` y devuelve su plantilla XYZ."""
+        self.vector_sources[name] = source
+        return f"{self.public_url}/mvt/{name}/{{z}}/{{x}}/{{y}}.pbf"
+
+    def _render_vector(self, name, z, x, y):
+        return self.vector_sources[name].render(z, x, y)
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
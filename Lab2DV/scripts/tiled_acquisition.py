@@ -0,0 +1,167 @@
+"""
+Adquisición por teselas para ROI grandes (p. ej. toda el área metropolitana).
+
+La ROI se divide en una grilla de teselas alineada a la resolución de salida
+(mismo origen y tamaño de píxel para todas), y solo se piden las que tocan la
+ROI. Cada tesela es una exportación con grilla explícita en `ExportManager`,
+con un máximo de teselas en curso a la vez; cada descarga se valida (CRS,
+transform, tamaño y bandas) antes de darla por buena. Al final las teselas se
+copian una a una a su ventana en un GeoTIFF teselado con overviews, así el
+mosaico completo nunca está en memoria.
+
+    python scripts/tiled_acquisition.py --roi data/vector/santiago_roi.geojson --year 2024 \\
+        --project mi-proyecto --bucket mi-bucket --workers 8
+"""
+import logging
+import math
+import time
+from pathlib import Path
+
+import click
+import geopandas as gpd
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.windows import Window
+from rasterio.windows import bounds as window_bounds
+from shapely.geometry import box, mapping
+from shapely.prepared import prep
+
+from gee_export import EarthEngineClient, ExportManager, FakeEEClient, export_params
+from indices import DEFAULT_BAND_ORDER, OUTPUT_PROFILE, RAW_TEMPLATE
+from raster_io import ensure_overviews
+
+logger = logging.getLogger(__name__)
+
+TILE_PIXELS = 2048
+
+
+def tile_grid(roi, crs, scale=10, tile_pixels=TILE_PIXELS):
+    """
+    Grilla de salida y teselas que tocan la ROI.
+
+    Devuelve ({"crs", "transform", "width", "height"}, [(fila, col, Window, geometría ROI ∩ tesela)]),
+    con la geometría en `crs`. Las teselas del borde se recortan a la extensión de la ROI.
+    """
+    geom = roi.to_crs(crs).union_all()
+    minx, miny, maxx, maxy = geom.bounds
+    x0, y0 = math.floor(minx / scale) * scale, math.ceil(maxy / scale) * scale
+    width, height = math.ceil((maxx - x0) / scale), math.ceil((y0 - miny) / scale)
+    transform = Affine(scale, 0, x0, 0, -scale, y0)
+
+    prepared = prep(geom)
+    tiles = []
+    for r in range(math.ceil(height / tile_pixels)):
+        for c in range(math.ceil(width / tile_pixels)):
+            window = Window(
+                c * tile_pixels, r * tile_pixels,
+                min(tile_pixels, width - c * tile_pixels), min(tile_pixels, height - r * tile_pixels),
+            )
+            cell = box(*window_bounds(window, transform))
+            if prepared.intersects(cell):
+                tiles.append((r, c, window, geom.intersection(cell)))
+    grid = {"crs": str(crs), "transform": transform, "width": width, "height": height}
+    return grid, tiles
+
+
+def tile_jobs(roi, year, crs, scale=10, tile_pixels=TILE_PIXELS, bands=DEFAULT_BAND_ORDER):
+    """Trabajos de exportación {nombre: parámetros} de cada tesela y la grilla del mosaico."""
+    grid, tiles = tile_grid(roi, crs, scale, tile_pixels)
+    parts = gpd.GeoSeries([g for *_, g in tiles], crs=crs).to_crs("EPSG:4326")
+    jobs = {}
+    for (r, c, window, _), part in zip(tiles, parts):
+        x, y = grid["transform"] * (window.col_off, window.row_off)
+        jobs[f"tile_{year}_r{r:03d}_c{c:03d}"] = export_params(
+            mapping(part), year, bands, scale, str(crs),
+            crs_transform=[scale, 0, x, 0, -scale, y],
+            dimensions=[window.width, window.height],
+            window=[window.col_off, window.row_off, window.width, window.height],
+        )
+    return jobs, grid
+
+
+def validate_tile(name, params, path):
+    """Lanza ValueError si la tesela descargada no calza con la grilla pedida."""
+    with rasterio.open(path) as src:
+        problems = []
+        if src.count != len(params["bands"]):
+            problems.append(f"{src.count} bandas en vez de {len(params['bands'])}")
+        if [src.width, src.height] != list(params["dimensions"]):
+            problems.append(f"tamaño {src.width}x{src.height} en vez de {params['dimensions']}")
+        if src.crs != CRS.from_user_input(params["crs"]):
+            problems.append(f"CRS {src.crs}")
+        if not src.transform.almost_equals(Affine(*params["crs_transform"])):
+            problems.append("transform desalineado")
+    if problems:
+        raise ValueError(f"{name}: " + ", ".join(problems))
+
+
+def mosaic_tiles(tiles, grid, out_path, bands=DEFAULT_BAND_ORDER):
+    """
+    Copia las teselas {ruta: parámetros} a su ventana en `out_path` y agrega overviews.
+
+    Se lee y escribe una tesela a la vez; las que faltan quedan sin dato.
+    """
+    profile = dict(
+        OUTPUT_PROFILE, count=len(bands), width=grid["width"], height=grid["height"],
+        crs=grid["crs"], transform=grid["transform"],
+    )
+    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+    with rasterio.open(out_path, "w", **profile) as dst:
+        for i, band in enumerate(bands, start=1):
+            dst.set_band_description(i, band)
+        for path, params in tiles.items():
+            with rasterio.open(path) as src:
+                data = src.read(masked=True).astype("float32").filled(np.nan)
+            dst.write(data, window=Window(*params["window"]))
+    ensure_overviews(out_path, lock=False)
+    return Path(out_path)
+
+
+@click.command()
+@click.option("--roi", "roi_path", required=True, help="Polígono de la ROI (cualquier formato OGR)")
+@click.option("--year", required=True, type=int, help="Año del compuesto")
+@click.option("--output", default=None, help="GeoTIFF de salida (por defecto data/raw/sentinel2_pudahuel_{año}.tif)")
+@click.option("--tiles-dir", default="data/raw/tiles", help="Directorio de teselas y estado")
+@click.option("--tile-size", default=TILE_PIXELS, type=int, help="Lado de la tesela en píxeles")
+@click.option("--scale", default=10, type=int, help="Resolución en metros")
+@click.option("--crs", default="EPSG:32719", help="CRS de salida")
+@click.option("--workers", default=8, type=int, help="Teselas en curso a la vez")
+@click.option("--download-workers", default=4, type=int, help="Descargas en paralelo")
+@click.option("--poll", "poll_interval", default=10.0, type=float, help="Intervalo inicial de consulta (s)")
+@click.option("--project", default=None, help="Proyecto de Google Cloud para Earth Engine")
+@click.option("--bucket", default=None, help="Bucket de Cloud Storage para las exportaciones")
+@click.option("--fake", is_flag=True, help="Simula Earth Engine en local (ensayos sin credenciales)")
+def main(roi_path, year, output, tiles_dir, tile_size, scale, crs, workers, download_workers, poll_interval,
+         project, bucket, fake):
+    """Adquiere una ROI grande por teselas en paralelo y arma el mosaico."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if fake:
+        client = FakeEEClient()
+    elif project and bucket:
+        client = EarthEngineClient(project, bucket)
+    else:
+        raise click.UsageError("Se requieren --project y --bucket (o --fake)")
+
+    jobs, grid = tile_jobs(gpd.read_file(roi_path), year, crs, scale, tile_size)
+    logger.info(f"{len(jobs)} teselas de {tile_size}px para una grilla de {grid['width']}x{grid['height']}")
+    tiles_dir = Path(tiles_dir) / str(year)
+    manager = ExportManager(
+        client, tiles_dir, download_workers=download_workers, poll_interval=poll_interval, validate=validate_tile
+    )
+    t0 = time.monotonic()
+    results = manager.run(jobs, max_workers=workers)
+    failed = [name for name, r in results.items() if isinstance(r, Exception)]
+    logger.info(f"{len(jobs) - len(failed)}/{len(jobs)} teselas en {time.monotonic() - t0:.1f}s")
+    if failed:
+        # Sin mosaico parcial: al repetir el comando solo se piden las teselas que faltan
+        raise click.ClickException(f"Teselas con error: {', '.join(sorted(failed))}")
+
+    out_path = Path(output or Path("data/raw") / RAW_TEMPLATE.format(year=year))
+    mosaic_tiles({results[name]: params for name, params in jobs.items()}, grid, out_path)
+    logger.info(f"Mosaico -> {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Tendencia por píxel sobre la serie completa de años.
+
+Para cada índice se calcula, por ventanas y en un pool de procesos:
+- pendiente OLS (unidades del índice por año),
+- pendiente de Theil–Sen (mediana de las pendientes entre pares de años),
+- Mann–Kendall: estadístico S, p-valor bilateral exacto (distribución de S
+  por conteo de inversiones, sin aproximación normal) y una capa de
+  tendencia significativa (+1 / -1 / 0).
+
+Los años pueden tener separación irregular (2017, 2019, 2021, 2024). Los
+píxeles con menos de `MIN_YEARS` valores válidos quedan sin dato. Las
+tendencias se resumen por zona con el motor de `zonal.py`.
+
+Con 4 años el menor p-valor exacto posible es 1/12 (≈0.083): para marcar
+tendencias significativas con la serie actual hace falta `--alpha 0.1`.
+
+    python scripts/trends.py --indices ndvi,ndbi --workers 4
+"""
+import logging
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import combinations
+from pathlib import Path
+
+import click
+import numpy as np
+import rasterio
+
+from indices import OUTPUT_PROFILE, OUTPUT_TEMPLATE, WINDOW_SIZE
+from raster_io import bounded_map, iter_tiles
+from raster_stats import write_stats_sidecar
+from zonal import label_raster, zonal_stats
+
+logger = logging.getLogger(__name__)
+
+MIN_YEARS = 3
+DEFAULT_ALPHA = 0.05
+TREND_LAYERS = ("ols_slope", "sen_slope", "mk_p", "mk_trend")
+TREND_TEMPLATE = "trend_{index}_{layer}_{start}_{end}.tif"
+
+
+@lru_cache(maxsize=None)
+def mk_pvalues(n):
+    """
+    p-valor bilateral exacto de Mann–Kendall para cada |S| posible con `n` datos.
+
+    Devuelve un arreglo indexado por |S| (0..n(n-1)/2). S = pares - 2·inversiones,
+    y el número de permutaciones con k inversiones sale de un conteo recursivo.
+    """
+    pairs = n * (n - 1) // 2
+    counts = np.zeros(pairs + 1)
+    counts[0] = 1
+    for m in range(2, n + 1):
+        # Insertar el m-ésimo elemento agrega entre 0 y m-1 inversiones
+        new = np.zeros_like(counts)
+        for k in range(m):
+            new[k:] += counts[: pairs + 1 - k]
+        counts = new
+    prob = counts / counts.sum()
+    s_values = pairs - 2 * np.arange(pairs + 1)
+    out = np.empty(pairs + 1)
+    for s in range(pairs + 1):
+        out[s] = prob[np.abs(s_values) >= s].sum()
+    out.setflags(write=False)
+    return out
+
+
+def pixel_trends(stack, years, alpha=DEFAULT_ALPHA, min_years=MIN_YEARS):
+    """
+    Tendencias de un bloque (años, alto, ancho) con NaN como sin dato.
+
+    Devuelve {capa: arreglo float32 (alto, ancho)} con las capas de TREND_LAYERS.
+    """
+    t, h, w = stack.shape
+    y = stack.reshape(t, -1).astype(np.float64)
+    x = np.asarray(years, dtype=np.float64)[:, None]
+    valid = np.isfinite(y)
+    n = valid.sum(axis=0)
+    ok = n >= min_years
+
+    # OLS con las medias de los años válidos de cada píxel
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # píxeles sin datos
+        xv = np.where(valid, x, np.nan)
+        xm = np.nanmean(xv, axis=0)
+        ym = np.nanmean(y, axis=0)
+        dx = xv - xm
+        ols = np.nansum(dx * (y - ym), axis=0) / np.nansum(dx * dx, axis=0)
+
+    # Theil–Sen y Mann–Kendall sobre todos los pares (i < j)
+    i, j = np.array(list(combinations(range(t), 2))).T
+    diff = y[j] - y[i]
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        sen = np.nanmedian(diff / (x[j] - x[i]), axis=0) if i.size else np.full(y.shape[1], np.nan)
+        s = np.nansum(np.sign(diff), axis=0).astype(np.int64)
+
+    p = np.full(y.shape[1], np.nan)
+    for k in np.unique(n[ok]):
+        sel = ok & (n == k)
+        table = mk_pvalues(int(k))
+        p[sel] = table[np.minimum(np.abs(s[sel]), table.size - 1)]
+    trend = np.where(p < alpha, np.sign(s), 0.0)
+
+    out = {"ols_slope": ols, "sen_slope": sen, "mk_p": p, "mk_trend": trend}
+    for name, arr in out.items():
+        arr = np.where(ok, arr, np.nan)
+        out[name] = arr.reshape(h, w).astype("float32")
+    return out
+
+
+def _trend_window(args):
+    paths, years, window, alpha = args
+    stack = np.empty((len(paths), window.height, window.width), dtype="float32")
+    for k, path in enumerate(paths):
+        with rasterio.open(path) as src:
+            stack[k] = src.read(1, window=window, masked=True).astype("float32").filled(np.nan)
+    return window, pixel_trends(stack, years, alpha)
+
+
+def trend_rasters(index_paths, out_dir, index, alpha=DEFAULT_ALPHA, pool=None, window_size=WINDOW_SIZE):
+    """
+    Escribe las capas de tendencia de {año: ruta} y devuelve {capa: ruta}.
+
+    Con `pool` las ventanas se calculan en paralelo, con a lo sumo dos por
+    proceso en curso; la memoria queda acotada a años x ventana por proceso.
+    """
+    years = sorted(index_paths)
+    paths = [str(index_paths[y]) for y in years]
+    with rasterio.open(paths[0]) as ref:
+        profile = dict(OUTPUT_PROFILE, width=ref.width, height=ref.height, crs=ref.crs, transform=ref.transform)
+        windows = list(iter_tiles(ref.width, ref.height, window_size))
+        for p in paths[1:]:
+            with rasterio.open(p) as src:
+                if (src.shape, src.transform) != (ref.shape, ref.transform):
+                    raise ValueError(f"{Path(p).name} no comparte la grilla de {Path(paths[0]).name}")
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_paths = {
+        layer: out_dir / TREND_TEMPLATE.format(index=index, layer=layer, start=years[0], end=years[-1])
+        for layer in TREND_LAYERS
+    }
+    jobs = [(paths, years, w, alpha) for w in windows]
+    results = bounded_map(pool, _trend_window, jobs)
+
+    dsts = {}
+    try:
+        for layer, path in out_paths.items():
+            dsts[layer] = rasterio.open(path, "w", **profile)
+        for window, arrays in results:
+            for layer, arr in arrays.items():
+                dsts[layer].write(arr, 1, window=window)
+    finally:
+        for dst in dsts.values():
+            dst.close()
+
+    for path in out_paths.values():
+        write_stats_sidecar(path)
+    return out_paths
+
+
+def zone_trends(trend_paths, index, zones_path, cache_dir, id_field="zone_id"):
+    """Resumen por zona: pendientes medias y % de píxeles con tendencia significativa."""
+    layers = {f"{index}_{layer}": path for layer, path in trend_paths.items() if layer != "mk_p"}
+    labels_path, zone_ids = label_raster(zones_path, trend_paths["sen_slope"], cache_dir, id_field)
+    thresholds = {
+        f"{index}_mk_trend": [
+            (f"{index}_perc_signif_up", ">=", 1),
+            (f"{index}_perc_signif_down", "<=", -1),
+        ]
+    }
+    return zonal_stats(labels_path, layers, zone_ids, thresholds)
+
+
+@click.command()
+@click.option("--input", "input_dir", default="data/processed", help="Directorio con los productos .tif")
+@click.option("--output", "output_dir", default="data/processed", help="Directorio de las capas de tendencia")
+@click.option("--years", default="2017,2019,2021,2024", help="Años separados por coma")
+@click.option("--indices", "names", default="ndvi,ndbi", help="Índices separados por coma")
+@click.option("--alpha", default=DEFAULT_ALPHA, type=float, help="Nivel de significancia de Mann–Kendall")
+@click.option("--workers", default=None, type=int, help="Procesos (por defecto, núcleos disponibles)")
+@click.option("--zones", "zones_path", default="data/processed/cambios_por_zona.gpkg", help="Capa de zonas")
+@click.option("--zones-output", default="outputs", help="Directorio de los CSV por zona")
+@click.option("--cache", "cache_dir", default="data/cache/zonal", help="Caché del raster de etiquetas")
+def main(input_dir, output_dir, years, names, alpha, workers, zones_path, zones_output, cache_dir):
+    """Calcula tendencias por píxel y su resumen por zona."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    input_dir = Path(input_dir)
+    years = [int(y) for y in years.split(",") if y.strip()]
+    names = [n.strip().lower() for n in names.split(",") if n.strip()]
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for index in names:
+            index_paths = {y: input_dir / OUTPUT_TEMPLATE.format(index=index, year=y) for y in years}
+            index_paths = {y: p for y, p in index_paths.items() if p.exists()}
+            if len(index_paths) < MIN_YEARS:
+                logger.warning(f"{index.upper()}: se necesitan al menos {MIN_YEARS} años, hay {len(index_paths)}")
+                continue
+            logger.info(f"{index.upper()}: tendencias {min(index_paths)}-{max(index_paths)}")
+            trend_paths = trend_rasters(index_paths, output_dir, index, alpha, pool=pool)
+
+            if Path(zones_path).exists():
+                df = zone_trends(trend_paths, index, zones_path, cache_dir)
+                out_csv = Path(zones_output) / f"tendencias_{index}_por_zona.csv"
+                out_csv.parent.mkdir(parents=True, exist_ok=True)
+                df.to_csv(out_csv, index=False)
+                logger.info(f"Resumen por zona -> {out_csv}")
+
+
+if __name__ == "__main__":
+    main()
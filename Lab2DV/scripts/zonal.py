@@ -0,0 +1,239 @@
+"""
+Estadísticas zonales con un raster de etiquetas y agregación por `np.bincount`.
+
+La capa de zonas se rasteriza una sola vez a un raster de enteros alineado con
+la grilla de los índices (0 = fuera de toda zona) y se guarda en caché. Luego,
+en una sola pasada por ventanas, cada capa aporta count/suma/media/M2/mín/máx
+y conteos sobre umbrales para todas las zonas a la vez: el costo depende de
+los píxeles, no del número de zonas.
+
+    python scripts/zonal.py --zones data/processed/cambios_por_zona.gpkg --output outputs/zonal_stats.csv
+"""
+import json
+import logging
+import operator
+from pathlib import Path
+
+import click
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import rasterio
+import shapely
+from rasterio.features import rasterize
+from rasterio.windows import bounds as window_bounds
+from rasterio.windows import transform as window_transform
+
+from change_detection import NDBI_GAIN, NDVI_LOSS
+from disk_cache import DiskCache, file_fingerprint, file_lock, make_key
+from indices import INDICES, OUTPUT_TEMPLATE, WINDOW_SIZE
+from raster_io import iter_tiles
+
+logger = logging.getLogger(__name__)
+
+LABEL_DTYPE = "uint32"
+OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+# Métricas de cambio de cambios_por_zona.gpkg: % de píxeles válidos sobre el umbral
+CHANGE_THRESHOLDS = {
+    "delta_ndvi": [("perc_loss_veg", "<=", NDVI_LOSS)],
+    "delta_ndbi": [("perc_gain_built", ">=", NDBI_GAIN)],
+}
+
+
+def _grid_signature(src):
+    return {"crs": src.crs.to_wkt() if src.crs else None, "transform": list(src.transform)[:6], "shape": src.shape}
+
+
+def write_label_raster(zones_gdf, ref_path, out_path, tags=None):
+    """Rasteriza las zonas en la grilla de `ref_path`: la zona i (0-based) queda como i + 1."""
+    with rasterio.open(ref_path) as ref:
+        zones = zones_gdf.to_crs(ref.crs) if ref.crs else zones_gdf
+        geoms = zones.geometry.values
+        tree = shapely.STRtree(geoms)
+        profile = {
+            "driver": "GTiff",
+            "dtype": LABEL_DTYPE,
+            "count": 1,
+            "nodata": 0,
+            "width": ref.width,
+            "height": ref.height,
+            "crs": ref.crs,
+            "transform": ref.transform,
+            "tiled": True,
+            "blockxsize": 256,
+            "blockysize": 256,
+            "compress": "deflate",
+        }
+        with rasterio.open(out_path, "w", **profile) as dst:
+            if tags:
+                dst.update_tags(**tags)
+            for window in iter_tiles(ref.width, ref.height, WINDOW_SIZE):
+                # Solo las zonas que tocan la ventana
+                idx = tree.query(shapely.box(*window_bounds(window, ref.transform)))
+                labels = np.zeros((window.height, window.width), dtype=LABEL_DTYPE)
+                if len(idx):
+                    rasterize(
+                        zip(geoms[idx], idx + 1),
+                        out=labels,
+                        transform=window_transform(window, ref.transform),
+                    )
+                dst.write(labels, 1, window=window)
+
+
+def label_raster(zones_path, ref_path, cache_dir, id_field="zone_id"):
+    """
+    Ruta del raster de etiquetas (en caché) y los ids de zona por etiqueta.
+
+    `ids[label - 1]` es el `id_field` de la zona con esa etiqueta.
+    """
+    with rasterio.open(ref_path) as ref:
+        grid = _grid_signature(ref)
+    cache = DiskCache(cache_dir, suffix=".tif")
+    key = "labels_" + make_key(file_fingerprint(zones_path), grid, id_field)[:16]
+    # Un solo proceso/hilo rasteriza; los demás esperan y reutilizan el resultado
+    with file_lock(cache.root / ".labels.lock"):
+        path = cache.get_path(key)
+        if path is None:
+            zones = gpd.read_file(zones_path)
+            ids = zones[id_field].tolist() if id_field in zones.columns else list(range(len(zones)))
+            tags = {"zone_ids": json.dumps(ids, default=str)}
+            path = cache.put_file(key, lambda out: write_label_raster(zones, ref_path, out, tags))
+    with rasterio.open(path) as src:
+        ids = json.loads(src.tags()["zone_ids"])
+    return path, ids
+
+
+class ZonalAccumulator:
+    """Acumula estadísticas por etiqueta (1..n) sobre bloques de píxeles."""
+
+    def __init__(self, n_zones, thresholds=()):
+        size = n_zones + 1
+        self.count = np.zeros(size, dtype=np.int64)
+        self.sum = np.zeros(size)
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+        # thresholds: [(nombre, operador, valor)]
+        self.thresholds = list(thresholds)
+        self.hits = {name: np.zeros(size, dtype=np.int64) for name, _, _ in self.thresholds}
+
+    def update(self, labels, values):
+        valid = (labels > 0) & np.isfinite(values)
+        lab = labels[valid].astype(np.intp)
+        if lab.size == 0:
+            return
+        v = values[valid].astype(np.float64)
+        n = self.count.size
+        n_b = np.bincount(lab, minlength=n)
+        s_b = np.bincount(lab, weights=v, minlength=n)
+        mean_b = np.divide(s_b, n_b, out=np.zeros(n), where=n_b > 0)
+        d = v - mean_b[lab]
+        m2_b = np.bincount(lab, weights=d * d, minlength=n)
+
+        # Fusión de Chan et al. por etiqueta, como `RunningStats._merge`
+        n_a = self.count
+        total = n_a + n_b
+        delta = mean_b - self.mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.mean += np.where(total > 0, delta * n_b / total, 0.0)
+            self.m2 += m2_b + np.where(total > 0, delta * delta * n_a * n_b / total, 0.0)
+        self.count = total
+        self.sum += s_b
+        for name, op, thr in self.thresholds:
+            self.hits[name] += np.bincount(lab[OPERATORS[op](v, thr)], minlength=n)
+
+        # Mín/máx: se ordena por etiqueta y se reduce por tramos
+        order = np.argsort(lab, kind="stable")
+        lab, v = lab[order], v[order]
+        starts = np.flatnonzero(np.r_[True, lab[1:] != lab[:-1]])
+        present = lab[starts]
+        self.min[present] = np.minimum(self.min[present], np.minimum.reduceat(v, starts))
+        self.max[present] = np.maximum(self.max[present], np.maximum.reduceat(v, starts))
+
+    def to_frame(self, prefix=""):
+        """DataFrame indexado por etiqueta (1..n) con count/mean/std/min/max y porcentajes."""
+        c = self.count[1:]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cols = {
+                "count": c,
+                "sum": self.sum[1:],
+                "mean": np.where(c > 0, self.mean[1:], np.nan),
+                "std": np.sqrt(self.m2[1:] / c),
+                "min": np.where(c > 0, self.min[1:], np.nan),
+                "max": np.where(c > 0, self.max[1:], np.nan),
+            }
+            for name, _, _ in self.thresholds:
+                cols[name] = 100.0 * self.hits[name][1:] / c
+        df = pd.DataFrame(cols, index=pd.RangeIndex(1, c.size + 1, name="label"))
+        return df.add_prefix(prefix) if prefix else df
+
+
+def zonal_stats(labels_path, layers, zone_ids, thresholds=None):
+    """
+    Estadísticas de todas las zonas para `layers` ({nombre: ruta}) en una pasada.
+
+    `thresholds` es {nombre de capa: [(columna, operador, valor)]}. Las
+    columnas de salida son `<capa>_<estadístico>`, más las de umbral sin prefijo.
+    """
+    thresholds = thresholds or {}
+    layers = {name: Path(p) for name, p in layers.items() if Path(p).exists()}
+    acc = {name: ZonalAccumulator(len(zone_ids), thresholds.get(name, ())) for name in layers}
+    srcs = {name: rasterio.open(p) for name, p in layers.items()}
+    try:
+        with rasterio.open(labels_path) as lab_src:
+            for name, src in srcs.items():
+                if (src.shape, src.transform) != (lab_src.shape, lab_src.transform):
+                    raise ValueError(f"{layers[name].name} no está alineado con el raster de etiquetas")
+            for window in iter_tiles(lab_src.width, lab_src.height, WINDOW_SIZE):
+                labels = lab_src.read(1, window=window)
+                if not labels.any():
+                    continue
+                for name, src in srcs.items():
+                    values = src.read(1, window=window, masked=True).astype("float32").filled(np.nan)
+                    acc[name].update(labels, values)
+    finally:
+        for src in srcs.values():
+            src.close()
+
+    frames = []
+    for name, a in acc.items():
+        df = a.to_frame(prefix=f"{name}_")
+        frames.append(df.rename(columns={f"{name}_{col}": col for col, _, _ in a.thresholds}))
+    out = pd.concat(frames, axis=1) if frames else pd.DataFrame(index=pd.RangeIndex(1, len(zone_ids) + 1))
+    out.insert(0, "zone_id", zone_ids)
+    return out.reset_index(drop=True)
+
+
+@click.command()
+@click.option("--zones", "zones_path", default="data/processed/cambios_por_zona.gpkg", help="Capa de zonas")
+@click.option("--input", "input_dir", default="data/processed", help="Directorio con los productos .tif")
+@click.option("--output", default="outputs/zonal_stats.csv", help="CSV de salida")
+@click.option("--years", default="2017,2019,2021,2024", help="Años separados por coma")
+@click.option("--indices", "names", default=",".join(INDICES), help="Índices separados por coma")
+@click.option("--cache", "cache_dir", default="data/cache/zonal", help="Caché del raster de etiquetas")
+@click.option("--id-field", default="zone_id", help="Campo identificador de zona")
+def main(zones_path, input_dir, output, years, names, cache_dir, id_field):
+    """Calcula estadísticas por zona, año e índice, y las métricas de cambio."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    input_dir = Path(input_dir)
+    years = [int(y) for y in years.split(",") if y.strip()]
+    names = [n.strip().lower() for n in names.split(",") if n.strip()]
+
+    layers = {f"{n}_{y}": input_dir / OUTPUT_TEMPLATE.format(index=n, year=y) for n in names for y in years}
+    layers["delta_ndvi"] = input_dir / f"delta_ndvi_{years[0]}_{years[-1]}.tif"
+    layers["delta_ndbi"] = input_dir / f"delta_ndbi_{years[0]}_{years[-1]}.tif"
+    ref = next((p for p in layers.values() if p.exists()), None)
+    if ref is None:
+        raise click.ClickException(f"No hay productos en {input_dir}")
+
+    labels_path, zone_ids = label_raster(zones_path, ref, cache_dir, id_field)
+    df = zonal_stats(labels_path, layers, zone_ids, CHANGE_THRESHOLDS)
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(output, index=False)
+    logger.info(f"{len(df)} zonas x {len(df.columns) - 1} columnas -> {output}")
+
+
+if __name__ == "__main__":
+    main()
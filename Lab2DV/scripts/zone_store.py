@@ -0,0 +1,168 @@
+"""
+Almacén de zonas en GeoParquet para la carga en frío del dashboard.
+
+A partir de `cambios_por_zona.gpkg` se escriben dos GeoParquet: uno en el CRS
+de análisis y otro ya en WGS84 (listo para el mapa). Ambos van ordenados por
+la curva de Hilbert de las zonas, así las vecinas quedan en los mismos row
+groups. `zonas.json` guarda límites, centro (centroide de la unión, calculado
+una sola vez aquí), columnas y la firma del GPKG de origen: el dashboard lee
+solo las columnas que usa y toma el centro de los metadatos. `ZoneIndex`
+resuelve las búsquedas por id y por ranking de métricas sin recorrer la tabla.
+
+Requiere `pyarrow`.
+
+    python scripts/zone_store.py --source data/processed/cambios_por_zona.gpkg
+"""
+import json
+import logging
+import os
+from pathlib import Path
+
+import click
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from exports import parquet_available
+from raster_stretch import source_signature
+
+logger = logging.getLogger(__name__)
+
+STORE_FILES = {"analysis": "zonas.parquet", "wgs84": "zonas_wgs84.parquet"}
+META_FILE = "zonas.json"
+ROW_GROUP = 10_000
+
+
+def build_zone_store(source, out_dir, row_group_size=ROW_GROUP):
+    """Escribe los GeoParquet y los metadatos de `source` en `out_dir`."""
+    if not parquet_available():
+        raise RuntimeError("El almacén de zonas requiere pyarrow")
+    source, out_dir = Path(source), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # Firma antes de leer: si el GPKG cambia mientras tanto, el almacén queda desactualizado
+    signature = source_signature(source)
+
+    gdf = gpd.read_file(source)
+    if gdf.crs is None:
+        gdf = gdf.set_crs("EPSG:4326")
+    if len(gdf):
+        gdf = gdf.iloc[gdf.hilbert_distance().argsort(kind="stable")].reset_index(drop=True)
+    wgs = gdf.to_crs("EPSG:4326")
+    centroid = wgs.union_all().centroid if len(wgs) else None
+
+    for key, frame in (("analysis", gdf), ("wgs84", wgs)):
+        tmp = out_dir / (STORE_FILES[key] + ".tmp")
+        frame.to_parquet(tmp, index=False, compression="zstd", row_group_size=row_group_size)
+        os.replace(tmp, out_dir / STORE_FILES[key])
+
+    meta = {
+        "crs": gdf.crs.to_wkt(),
+        "rows": len(gdf),
+        "columns": [c for c in gdf.columns if c != "geometry"],
+        "bounds": list(map(float, gdf.total_bounds)) if len(gdf) else None,
+        "bounds_wgs84": list(map(float, wgs.total_bounds)) if len(wgs) else None,
+        # (lat, lon), como lo usa folium
+        "center": [centroid.y, centroid.x] if centroid is not None else None,
+        "source": {"path": os.path.relpath(source, out_dir), **signature},
+    }
+    (out_dir / META_FILE).write_text(json.dumps(meta, indent=1))
+    return ZoneStore(out_dir)
+
+
+def open_zone_store(store_dir):
+    """El almacén de `store_dir`, o None si no existe, falta pyarrow o está desactualizado."""
+    store_dir = Path(store_dir)
+    if not parquet_available() or not (store_dir / META_FILE).exists():
+        return None
+    store = ZoneStore(store_dir)
+    return store if store.is_fresh() else None
+
+
+class ZoneStore:
+    """Lectura del almacén de zonas."""
+
+    def __init__(self, store_dir):
+        self.dir = Path(store_dir)
+        self.meta = json.loads((self.dir / META_FILE).read_text())
+        self.columns = self.meta["columns"]
+        self.center = tuple(self.meta["center"]) if self.meta["center"] else None
+        self.bounds = self.meta["bounds_wgs84"]
+
+    def is_fresh(self):
+        """True si los GeoParquet existen y el GPKG de origen no cambió."""
+        if not all((self.dir / name).exists() for name in STORE_FILES.values()):
+            return False
+        src = self.meta["source"]
+        try:
+            sig = source_signature(self.dir / src["path"])
+        except OSError:
+            return False
+        return (sig["size"], sig["mtime_ns"]) == (src["size"], src["mtime_ns"])
+
+    def read(self, columns=None, crs="wgs84"):
+        """GeoDataFrame con `columns` (las que existan) + geometría; `crs` es "wgs84" o "analysis"."""
+        if columns is not None:
+            columns = [c for c in columns if c in self.columns] + ["geometry"]
+        return gpd.read_parquet(self.dir / STORE_FILES[crs], columns=columns)
+
+
+class ZoneIndex:
+    """
+    Índice en memoria de las zonas: id -> fila, ids ordenados y columnas numéricas tipadas.
+
+    Se arma una vez por carga; las búsquedas por id son O(1) y el orden por
+    cada métrica se calcula la primera vez que se pide.
+    """
+
+    def __init__(self, gdf, id_field="zone_id"):
+        self.gdf = gdf.reset_index(drop=True)
+        self.ids = self.gdf[id_field].astype("int64").to_numpy()
+        self.sorted_ids = np.sort(self.ids).tolist()
+        self._pos = {z: i for i, z in enumerate(self.ids.tolist())}
+        self.values = {
+            c: self.gdf[c].to_numpy(dtype="float64", na_value=np.nan)
+            for c in self.gdf.columns
+            if c not in (id_field, "geometry") and pd.api.types.is_numeric_dtype(self.gdf[c])
+        }
+        self._order = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, zone_id):
+        return int(zone_id) in self._pos
+
+    def position(self, zone_id):
+        return self._pos[int(zone_id)]
+
+    def row(self, zone_id):
+        return self.gdf.iloc[self._pos[int(zone_id)]]
+
+    def geometry(self, zone_id):
+        return self.gdf.geometry.iloc[self._pos[int(zone_id)]]
+
+    def value(self, metric, zone_id):
+        return float(self.values[metric][self._pos[int(zone_id)]])
+
+    def top_k(self, metric, k=10, ascending=False):
+        """Ids de las `k` zonas con mayor (o menor) `metric`; los NaN quedan al final."""
+        key = (metric, ascending)
+        if key not in self._order:
+            v = self.values[metric]
+            order = np.argsort(v if ascending else -v, kind="stable")
+            self._order[key] = self.ids[order]  # argsort deja los NaN al final
+        return self._order[key][:k].tolist()
+
+
+@click.command()
+@click.option("--source", default="data/processed/cambios_por_zona.gpkg", help="GPKG de zonas con métricas")
+@click.option("--output", "output_dir", default="data/processed/zone_store", help="Directorio del almacén")
+def main(source, output_dir):
+    """Construye el almacén GeoParquet de zonas."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    store = build_zone_store(source, output_dir)
+    logger.info(f"{store.meta['rows']} zonas -> {output_dir} (centro {store.center})")
+
+
+if __name__ == "__main__":
+    main()
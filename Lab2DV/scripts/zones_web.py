@@ -0,0 +1,218 @@
+"""
+Capa de zonas optimizada para el mapa web.
+
+- Simplificación por nivel de zoom (tolerancia de medio píxel en EPSG:3857),
+  preservando los bordes compartidos entre zonas vecinas cuando shapely lo
+  permite (`coverage_simplify`).
+- Cuantización de coordenadas a los decimales que se distinguen a ese zoom.
+- Solo se serializan los atributos que usa el mapa.
+- `ClassifiedZones`: capa Leaflet que colorea por la clase precalculada
+  (`cls`) en el navegador y puede reutilizar los datos ya incrustados por
+  otra capa (p. ej. los dos paneles del comparador).
+- Opcionalmente, teselas vectoriales (MVT) generadas bajo demanda y servidas
+  por el servidor local de teselas (requiere `mapbox-vector-tile`).
+"""
+import json
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+from folium.map import Layer
+from jinja2 import Template
+from shapely.geometry import box
+
+from raster_tiles import tile_bounds
+
+try:
+    import mapbox_vector_tile
+except ImportError:  # dependencia opcional
+    mapbox_vector_tile = None
+
+ZONE_FIELDS = ["zone_id", "perc_loss_veg", "perc_gain_built"]
+WEB_ZOOMS = (10, 12, 14, 16)
+# Los porcentajes se muestran con 2 decimales
+ATTR_DIGITS = 2
+MVT_EXTENT = 4096
+MVT_LAYER = "zones"
+
+# Resolución (m/píxel) de una tesela de 256 px en el zoom 0 (EPSG:3857)
+RESOLUTION_Z0 = 2 * math.pi * 6378137 / 256
+
+
+def mvt_available():
+    return mapbox_vector_tile is not None
+
+
+def zoom_tolerance(zoom):
+    """Tolerancia de simplificación en metros EPSG:3857: medio píxel al `zoom`."""
+    return RESOLUTION_Z0 / (2 ** zoom) / 2
+
+
+def zoom_digits(zoom):
+    """Decimales (grados) necesarios para distinguir medio píxel al `zoom`."""
+    half_px_deg = 360.0 / (256 * 2 ** zoom) / 2
+    return max(0, math.ceil(-math.log10(half_px_deg)))
+
+
+def simplify_geoms(geoms, tolerance):
+    """Simplifica un arreglo de geometrías, preservando bordes compartidos si es posible."""
+    if hasattr(shapely, "coverage_simplify"):
+        try:
+            return shapely.coverage_simplify(geoms, tolerance)
+        except shapely.errors.GEOSException:
+            pass  # no es una cobertura válida (zonas traslapadas)
+    return shapely.simplify(geoms, tolerance, preserve_topology=True)
+
+
+def web_zones(zones_gdf, zoom, fields=ZONE_FIELDS, classes=None):
+    """
+    GeoDataFrame WGS84 simplificado y cuantizado para `zoom`, solo con `fields`.
+
+    `classes` (un entero por fila de `zones_gdf`) se agrega como propiedad `cls`.
+    """
+    cols = [c for c in fields if c in zones_gdf.columns]
+    gdf = zones_gdf[cols + ["geometry"]].to_crs("EPSG:3857")
+    if classes is not None:
+        gdf["cls"] = np.asarray(classes, dtype=np.int64)
+    floats = gdf[cols].select_dtypes("float").columns
+    gdf[floats] = gdf[floats].round(ATTR_DIGITS)
+
+    geoms = simplify_geoms(gdf.geometry.values, zoom_tolerance(zoom))
+    gdf = gdf.set_geometry(geoms, crs="EPSG:3857").to_crs("EPSG:4326")
+
+    # Redondear es consistente entre vecinos: el mismo vértice queda igual en ambos
+    digits = zoom_digits(zoom)
+    geoms = shapely.transform(gdf.geometry.values, lambda c: np.round(c, digits))
+    gdf = gdf.set_geometry(geoms, crs="EPSG:4326")
+    return gdf[~gdf.geometry.is_empty]
+
+
+def zones_geojson(zones_gdf, zoom, fields=ZONE_FIELDS, classes=None):
+    """GeoJSON (str) compacto de las zonas para `zoom`."""
+    return web_zones(zones_gdf, zoom, fields, classes).to_json(drop_id=True)
+
+
+class ClassifiedZones(Layer):
+    """
+    GeoJSON de zonas con estilo por clase resuelto en JavaScript.
+
+    Con `shared_with`, la capa no vuelve a incrustar los datos: usa la
+    variable JS definida por la otra capa, que debe renderizarse antes.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+        {%- if this.data is not none %}
+        var {{ this.data_name }} = {{ this.data }};
+        {%- endif %}
+        var {{ this.get_name() }} = L.geoJson({{ this.data_name }}, {
+            style: function(f) {
+                return {{ this.styles|tojson }}[f.properties.cls || 0];
+            },
+            onEachFeature: function(f, layer) {
+                var p = f.properties, rows = [];
+                var fmt = function(v) {
+                    return (typeof v === "number" && !Number.isInteger(v)) ? v.toFixed(2) : (v == null ? "" : v);
+                };
+                {{ this.tooltip|tojson }}.forEach(function(t) {
+                    rows.push("<b>" + t[1] + "</b>: " + fmt(p[t[0]]));
+                });
+                layer.bindTooltip(rows.join("<br>"), {sticky: true});
+            }
+        }).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, geojson=None, styles=None, tooltip=None, name=None, shared_with=None, **kwargs):
+        # Superpuesta (casilla en el LayerControl) como folium.GeoJson, no capa base
+        kwargs.setdefault("overlay", True)
+        kwargs.setdefault("control", True)
+        super().__init__(name=name, **kwargs)
+        self._name = "ClassifiedZones"
+        if shared_with is not None:
+            self.data_name, self.data = shared_with.data_name, None
+        else:
+            # Nombre fijo sin sufijo aleatorio para que streamlit-folium no lo reescriba
+            self.data_name = "zonesSharedData"
+            self.data = geojson if isinstance(geojson, str) else json.dumps(geojson)
+        self.styles = styles or []
+        self.tooltip = [list(t) for t in (tooltip or [])]
+
+
+def _clean_props(rec):
+    out = {}
+    for k, v in rec.items():
+        if v is None or (isinstance(v, float) and math.isnan(v)):
+            continue
+        out[k] = v.item() if hasattr(v, "item") else v
+    return out
+
+
+class ZoneTileSource:
+    """Genera teselas MVT de las zonas bajo demanda, con caché LRU acotado."""
+
+    def __init__(self, zones_gdf, fields=ZONE_FIELDS, max_tiles=1024):
+        if mapbox_vector_tile is None:
+            raise ImportError("Se requiere 'mapbox-vector-tile' para las teselas vectoriales")
+        cols = [c for c in fields if c in zones_gdf.columns]
+        gdf = zones_gdf.to_crs("EPSG:3857")
+        self.geoms = gdf.geometry.values
+        self.props = [_clean_props(r) for r in gdf[cols].round(ATTR_DIGITS).to_dict("records")]
+        self.tree = shapely.STRtree(self.geoms)
+        self.max_tiles = max_tiles
+        self._simplified = {}
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _geoms_for_zoom(self, z):
+        # Los niveles se agrupan en WEB_ZOOMS para no simplificar en cada zoom
+        level = min((lvl for lvl in WEB_ZOOMS if lvl >= z), default=WEB_ZOOMS[-1])
+        with self._lock:
+            geoms = self._simplified.get(level)
+        if geoms is None:
+            geoms = simplify_geoms(self.geoms, zoom_tolerance(level))
+            with self._lock:
+                self._simplified[level] = geoms
+        return geoms
+
+    def render(self, z, x, y):
+        key = (z, x, y)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile
+
+        tile = self._encode(z, x, y)
+
+        with self._lock:
+            self._tiles[key] = tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def _encode(self, z, x, y):
+        xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+        w, h = xmax - xmin, ymax - ymin
+        # Margen de unos píxeles para que los bordes no se corten en la tesela
+        pad = w * 8 / 256
+        idx = self.tree.query(box(xmin - pad, ymin - pad, xmax + pad, ymax + pad))
+
+        features = []
+        if len(idx):
+            geoms = shapely.clip_by_rect(
+                self._geoms_for_zoom(z)[idx], xmin - pad, ymin - pad, xmax + pad, ymax + pad
+            )
+            # Coordenadas de tesela con y hacia arriba; el codificador invierte el eje
+            scale = np.array([MVT_EXTENT / w, MVT_EXTENT / h])
+            origin = np.array([xmin, ymin])
+            geoms = shapely.transform(geoms, lambda c: np.round((c - origin) * scale))
+            for i, g in zip(idx, geoms):
+                if g is not None and not g.is_empty:
+                    features.append({"geometry": g, "properties": self.props[i]})
+
+        return mapbox_vector_tile.encode([{"name": MVT_LAYER, "features": features}])
@@ -5,14 +5,23 @@ Script para descargar datos geoespaciales de la comuna seleccionada.
 
 import os
 import sys
+import time
 import click
 import requests
 import geopandas as gpd
 import osmnx as ox
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
+# Caché HTTP compartido (Lab2DV/scripts/http_cache.py); si no está, osmnx usa ./cache
+sys.path.append(str(Path(__file__).resolve().parents[2] / 'Lab2DV' / 'scripts'))
+try:
+    from http_cache import install_osmnx_cache
+except ImportError:
+    install_osmnx_cache = None
+
 # Configurar logging
 logging.basicConfig(
     level=logging.INFO,
@@ -30,47 +39,99 @@ class DataDownloader:
         self.output_dir.mkdir(parents=True, exist_ok=True)
         logger.info(f"Inicializando descarga para comuna: {comuna_name}")
 
+    # Etiquetas de las capas de entidades OSM: se piden en una sola consulta a
+    # Overpass y luego se separan localmente por capa
+    OSM_FEATURE_LAYERS = {
+        'buildings': {'building': True},
+        'amenities': {'amenity': True},
+    }
+
+    def _timed(self, layer, func, *args):
+        """Ejecuta una descarga y registra su tiempo y los bytes escritos."""
+        start = time.perf_counter()
+        files = func(*args)
+        elapsed = time.perf_counter() - start
+        size = sum(Path(f).stat().st_size for f in files)
+        logger.info(f"[{layer}] {elapsed:.1f}s, {size / 1024:.0f} KB en {len(files)} archivo(s)")
+        return files
+
+    def _download_network(self, polygon):
+        """Red vial dentro del polígono de la comuna."""
+        G = ox.graph_from_polygon(polygon, network_type='all')
+        output_file = self.output_dir / 'osm_network.graphml'
+        ox.save_graphml(G, output_file)
+        logger.info(f"Red vial guardada en: {output_file}")
+        return [output_file]
+
+    def _download_features(self, polygon):
+        """
+        Edificios y amenidades con una única consulta de etiquetas combinadas.
+
+        La consulta es compartida; por capa se registran las entidades, los
+        bytes escritos y el tiempo de separación y escritura.
+        """
+        tags = {}
+        for layer_tags in self.OSM_FEATURE_LAYERS.values():
+            tags.update(layer_tags)
+        start = time.perf_counter()
+        features = ox.features_from_polygon(polygon, tags=tags)
+        logger.info(f"[entidades] consulta combinada: {len(features)} entidades en "
+                    f"{time.perf_counter() - start:.1f}s")
+
+        files = []
+        for layer, layer_tags in self.OSM_FEATURE_LAYERS.items():
+            start = time.perf_counter()
+            cols = [c for c in layer_tags if c in features.columns]
+            if not cols:
+                logger.warning(f"Sin entidades para {layer}")
+                continue
+            subset = features[features[cols].notna().any(axis=1)]
+            output_file = self.output_dir / f'osm_{layer}.geojson'
+            subset.to_file(output_file, driver='GeoJSON')
+            size = output_file.stat().st_size
+            logger.info(f"[{layer}] {len(subset)} entidades, {size / 1024:.0f} KB en "
+                        f"{time.perf_counter() - start:.1f}s -> {output_file}")
+            files.append(output_file)
+        return files
+
     def download_osm_data(self):
-        """Descarga datos de OpenStreetMap usando OSMnx."""
+        """
+        Descarga datos de OpenStreetMap usando OSMnx.
+
+        La comuna se geocodifica una sola vez y la red vial y las entidades se
+        descargan en paralelo, así el tiempo total se acerca al de la capa más lenta.
+        """
         try:
-            logger.info("Descargando red vial desde OSM...")
+            start = time.perf_counter()
 
             # Configurar OSMnx
-            ox.config(use_cache=True, log_console=True)
+            ox.settings.use_cache = True
+            ox.settings.log_console = True
+            if install_osmnx_cache is not None:
+                install_osmnx_cache()
 
-            # Descargar red vial
+            # Geocodificar una sola vez; las capas usan el polígono resultante
             place_query = f"{self.comuna}, Chile"
-            G = ox.graph_from_place(place_query, network_type='all')
-
-            # Guardar grafo
-            output_file = self.output_dir / 'osm_network.graphml'
-            ox.save_graphml(G, output_file)
-            logger.info(f"Red vial guardada en: {output_file}")
-
-            # Descargar edificios
-            logger.info("Descargando edificios...")
-            buildings = ox.geometries_from_place(
-                place_query,
-                tags={'building': True}
-            )
-
-            # Guardar edificios
-            buildings_file = self.output_dir / 'osm_buildings.geojson'
-            buildings.to_file(buildings_file, driver='GeoJSON')
-            logger.info(f"Edificios guardados en: {buildings_file}")
-
-            # Descargar amenidades
-            logger.info("Descargando amenidades...")
-            amenities = ox.geometries_from_place(
-                place_query,
-                tags={'amenity': True}
-            )
-
-            amenities_file = self.output_dir / 'osm_amenities.geojson'
-            amenities.to_file(amenities_file, driver='GeoJSON')
-            logger.info(f"Amenidades guardadas en: {amenities_file}")
-
-            return True
+            logger.info(f"Geocodificando: {place_query}")
+            boundary = ox.geocode_to_gdf(place_query)
+            polygon = boundary.geometry.union_all()
+
+            logger.info("Descargando red vial, edificios y amenidades desde OSM...")
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                futures = {
+                    'red vial': pool.submit(self._timed, 'red vial', self._download_network, polygon),
+                    'entidades': pool.submit(self._timed, 'entidades', self._download_features, polygon),
+                }
+                ok = True
+                for layer, future in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error(f"Error descargando {layer}: {e}")
+                        ok = False
+
+            logger.info(f"Descarga OSM completada en {time.perf_counter() - start:.1f}s")
+            return ok
 
         except Exception as e:
             logger.error(f"Error descargando datos OSM: {e}")